@@ -0,0 +1,104 @@
+"""Latency and throughput benchmark of asp commands against the local mock ArchivesSpace server.
+
+Starts benchmarks/mockserver.py in this process, points a temporary '.archivessnake.yml' at it, and runs each scenario
+several times in a fresh interpreter. For each one it reports the median and minimum wall time, the number of API
+requests and logins per run, and for batch commands the throughput in records per second. Server latency, jitter and
+error injection are configurable, so that concurrency, caching and retry changes can be compared reproducibly.
+
+    python benchmarks/commands.py [--runs N] [--records N] [--workers N] [--latency S] [--jitter S]
+                                  [--error-rate P] [--only SUBSTRING]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mockserver import MockServer
+from startup import make_env
+
+
+def scenarios(records, workers):
+    """(name, asp arguments, stdin, number of records processed) for each scenario. stdin can be a function of the run
+    number, for commands that must change the records on every run."""
+    w = ["--workers", str(workers)]
+    pairs = "".join(f"{i},{i}\n" for i in range(1, records + 1))
+
+    def edits(run):
+        # A new indicator on every run, since records that an edit leaves unchanged are not posted
+        return "container_id,indicator\n" + "".join(f"{i},{i}-{run}\n" for i in range(1, records + 1))
+
+    return [
+        ("repository get", ["repository", "get"], None, 1),
+        ("repository list (cached)", ["repository", "list"], None, 1),
+        ("container profile list (cached)", ["container", "profile", "list"], None, 1),
+        ("enumeration get", ["enumeration", "get", "1"], None, 1),
+        ("container get", ["container", "get", "1"], None, 1),
+        ("resource get", ["resource", "get", "--id", "1"], None, 1),
+        ("container export", ["container", "export", *w], None, records),
+        ("resource export --all", ["resource", "export", "--all", *w], None, max(5, records // 10)),
+        ("container index build --full", ["container", "index", "build", "--full"], None, records),
+        ("container edit-batch", ["container", "edit-batch", *w], edits, records),
+        ("resource instance add (stdin)", ["resource", "instance", "add", *w], pairs, records),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs per scenario")
+    parser.add_argument("--records", type=int, default=200, help="Number of containers and archival objects")
+    parser.add_argument("--workers", type=int, default=4, help="--workers for batch commands")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server delay in seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random server delay added on top")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for jitter and errors")
+    parser.add_argument("--only", default=None, help="Only run scenarios whose name contains this string")
+    args = parser.parse_args()
+
+    server = MockServer(records=args.records, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        seed=args.seed).start()
+    print(f"mock server {server.url}: {args.records} records, latency {args.latency * 1000:.0f} ms "
+          f"(+{args.jitter * 1000:.0f} ms jitter), error rate {args.error_rate:.0%}, {args.workers} workers")
+    print(f"{'scenario':<34} {'median':>9} {'min':>9} {'requests':>9} {'logins':>7} {'records/s':>10}  errors")
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        env = make_env(Path(tmp), server.port)
+        env["ASP_NO_DAEMON"] = "1"
+        for command in (["cache", "repository", "set", "2"], ["cache", "resource", "set", "1"]):
+            subprocess.run([sys.executable, "-m", "asp.main", *command], env=env, check=True)
+
+        for name, argv, stdin, count in scenarios(args.records, args.workers):
+            if args.only and args.only not in name:
+                continue
+            times = []
+            errors = 0
+            before = server.stats()
+            for run in range(args.runs):
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, "-m", "asp.main", *argv], env=env,
+                                        input=stdin(run) if callable(stdin) else stdin, text=True,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                times.append(time.perf_counter() - start)
+                if result.returncode != 0:
+                    errors += 1
+                    last_error = result.stderr.strip().splitlines()[-1:] or ["(no output)"]
+            after = server.stats()
+            median = statistics.median(times)
+            requests = (after["requests"] - before["requests"]) / args.runs
+            logins = (after["logins"] - before["logins"]) / args.runs
+            throughput = f"{count / median:10.1f}" if count > 1 else f"{'':>10}"
+            print(f"{name:<34} {median * 1000:7.0f}ms {min(times) * 1000:7.0f}ms {requests:9.1f} {logins:7.1f} "
+                  f"{throughput}  {errors}")
+            if errors:
+                print(f"    last error: {last_error[0]}", file=sys.stderr)
+                failed = True
+    server.stop()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Import-time budget for the 'asp' command line.
+
+Measures the cumulative time to import asp.main with 'python -X importtime', which is paid by every command before it
+does any work, and fails if the median exceeds the budget. It also fails if importing asp.main loads any of the
+libraries that are only needed to talk to the API: those must be imported when a command that uses them is run.
+
+    python benchmarks/importtime.py [--runs N] [--budget MS]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from startup import ConnectionCounter, make_env
+
+# Top-level packages that 'import asp.main' must not load
+DEFERRED = ["asnake", "requests", "urllib3", "httpx", "asyncio", "yaml", "sqlite3", "asp.aio", "asp.batch",
+            "asp.containers", "asp.jobs", "asp.resources", "asp.schemas", "asp.session",
+            "asp.search", "asp.snapshots"]
+
+
+def import_times(env):
+    """Run 'import asp.main' under -X importtime, returning {module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import asp.main"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+def loaded_modules(env):
+    code = "import sys, asp.main; print('\\n'.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs")
+    parser.add_argument("--budget", type=float, default=300, help="Budget in milliseconds for importing asp.main")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    args = parser.parse_args()
+
+    counter = ConnectionCounter()
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        env = make_env(Path(tmp), counter.port)
+        runs = [import_times(env) for _ in range(args.runs)]
+        median = statistics.median(run["asp.main"] for run in runs) / 1000
+        print(f"import asp.main  median {median:7.1f} ms  budget {args.budget:7.1f} ms")
+        print("slowest modules, including their imports (last run):")
+        top_level = {module: t for module, t in runs[-1].items() if "." not in module or module.startswith("asp.")}
+        for module, t in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {module:<30} {t / 1000:7.1f} ms")
+        if median > args.budget:
+            print("FAIL: importing asp.main exceeded the budget", file=sys.stderr)
+            failed = True
+
+        modules = loaded_modules(env)
+        loaded = [name for name in DEFERRED if name in modules]
+        if loaded:
+            print(f"FAIL: importing asp.main loaded {', '.join(loaded)}", file=sys.stderr)
+            failed = True
+        if counter.count:
+            print("FAIL: importing asp.main opened connections to the API", file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
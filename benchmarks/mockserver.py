@@ -0,0 +1,523 @@
+"""A local stand-in for the ArchivesSpace backend API, for benchmarking asp without a live instance.
+
+Implements, in memory, the endpoints that asp uses: login, repositories, top containers, resources, archival objects,
+container profiles, enumerations, batch imports, search, the version, and the schemas of the record types asp posts.
+Index endpoints support paging, 'all_ids', 'id_set' and 'modified_since'; updates check 'lock_version'; GET responses
+carry an ETag. Every request can be delayed (--latency, --jitter) and a fraction of them can fail with 503
+(--error-rate). Sessions expire like the real backend's (412), and can be expired on demand.
+
+Control endpoints, which skip the delay and don't need a session:
+
+    GET /_mock/stats                          request counts (total, per endpoint, logins, injected errors)
+    GET /_mock/expire                         invalidate every session token
+    GET /_mock/fail?n=N&status=S[&retry_after=R]  fail the next N requests with status S
+    GET /_mock/conflict?n=N                   simulate a concurrent edit before each of the next N updates
+
+Run it standalone and point the 'baseurl' of '.archivessnake.yml' at it, or use MockServer from another script:
+
+    python benchmarks/mockserver.py [--port N] [--latency S] [--jitter S] [--error-rate P] [--records N]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SESSION_HEADER = "X-ArchivesSpace-Session"
+REPO_ID = 2
+# Record types that live in a repository, and those at the top level of the API
+REPO_TYPES = {"top_containers": "top_container", "resources": "resource", "archival_objects": "archival_object"}
+GLOBAL_TYPES = {"container_profiles": "container_profile"}
+VERSION = "ArchivesSpace (v3.5.1)"
+
+
+def ref(record_type):
+    return {"type": "object", "subtype": "ref",
+            "properties": {"ref": {"type": f"JSONModel(:{record_type}) uri", "ifmissing": "error"}}}
+
+
+def schema(properties, uri=None, parent=None):
+    schema = {"$schema": "http://www.archivesspace.org/archivesspace.json", "version": 1, "type": "object",
+              "properties": {"uri": {"type": "string"}, "lock_version": {"type": ["integer", "string"]},
+                             "jsonmodel_type": {"type": "string", "ifmissing": "error"}, **properties}}
+    if uri:
+        schema["uri"] = uri
+    if parent:
+        schema["parent"] = parent
+    return schema
+
+
+# The schemas of the record types that asp creates or edits, with the constraints of the real ones that can be checked
+# without the database
+NOTE_TYPES = [{"type": f"JSONModel(:{t}) object"} for t in ("note_singlepart", "note_multipart", "note_bibliography")]
+SCHEMAS = {
+    "top_container": schema({
+        "indicator": {"type": "string", "maxLength": 255, "minLength": 1, "ifmissing": "error"},
+        "type": {"type": "string", "dynamic_enum": "container_type"},
+        "barcode": {"type": "string", "maxLength": 255},
+        "container_profile": ref("container_profile"),
+        "active_restrictions": {"type": "array", "readonly": True}}, uri="/repositories/:repo_id/top_containers"),
+    "container_profile": schema({
+        "name": {"type": "string", "maxLength": 255, "ifmissing": "error"},
+        "extent_dimension": {"type": "string", "enum": ["height", "width", "depth"], "ifmissing": "error"},
+        "dimension_units": {"type": "string", "dynamic_enum": "dimension_units", "ifmissing": "error"},
+        "width": {"type": "string", "ifmissing": "error", "pattern": "\\A\\d+(\\.\\d+)?\\z"},
+        "height": {"type": "string", "ifmissing": "error", "pattern": "\\A\\d+(\\.\\d+)?\\z"},
+        "depth": {"type": "string", "ifmissing": "error", "pattern": "\\A\\d+(\\.\\d+)?\\z"}},
+        uri="/container_profiles"),
+    "abstract_archival_object": schema({
+        "title": {"type": "string", "maxLength": 8192},
+        "publish": {"type": "boolean"},
+        "extents": {"type": "array", "items": {"type": "JSONModel(:extent) object"}},
+        "dates": {"type": "array", "items": {"type": "JSONModel(:date) object"}},
+        "instances": {"type": "array", "items": {"type": "JSONModel(:instance) object"}},
+        "notes": {"type": "array", "items": {"type": NOTE_TYPES}}}),
+    "resource": schema({
+        "title": {"type": "string", "minLength": 1, "maxLength": 8192, "ifmissing": "error"},
+        "id_0": {"type": "string", "maxLength": 255, "ifmissing": "error"},
+        "level": {"type": "string", "dynamic_enum": "archival_record_level", "ifmissing": "error"},
+        "extents": {"type": "array", "ifmissing": "error", "minItems": 1,
+                    "items": {"type": "JSONModel(:extent) object"}},
+        "dates": {"type": "array", "ifmissing": "error", "minItems": 1, "items": {"type": "JSONModel(:date) object"}},
+        "repository": ref("repository")}, uri="/repositories/:repo_id/resources", parent="abstract_archival_object"),
+    "archival_object": schema({
+        "title": {"type": "string", "maxLength": 8192},
+        "component_id": {"type": "string", "maxLength": 255},
+        "level": {"type": "string", "dynamic_enum": "archival_record_level", "ifmissing": "error"},
+        "resource": ref("resource"),
+        "parent": ref("archival_object")}, uri="/repositories/:repo_id/archival_objects",
+        parent="abstract_archival_object"),
+    "extent": schema({
+        "portion": {"type": "string", "dynamic_enum": "extent_portion", "ifmissing": "error"},
+        "number": {"type": "string", "maxLength": 255, "ifmissing": "error"},
+        "extent_type": {"type": "string", "dynamic_enum": "extent_extent_type", "ifmissing": "error"}}),
+    "date": schema({
+        "date_type": {"type": "string", "dynamic_enum": "date_type", "ifmissing": "error"},
+        "label": {"type": "string", "dynamic_enum": "date_label", "ifmissing": "error"},
+        "begin": {"type": "string", "maxLength": 255,
+                  "pattern": "\\A-?\\d{1,4}(\\-(0[1-9]|1[0-2])(\\-(0[1-9]|[12][0-9]|3[01]))?)?\\z"},
+        "end": {"type": "string", "maxLength": 255,
+                "pattern": "\\A-?\\d{1,4}(\\-(0[1-9]|1[0-2])(\\-(0[1-9]|[12][0-9]|3[01]))?)?\\z"},
+        "expression": {"type": "string", "maxLength": 255}}),
+    "instance": schema({
+        "instance_type": {"type": "string", "dynamic_enum": "instance_instance_type", "ifmissing": "error"},
+        "is_representative": {"type": "boolean"},
+        "sub_container": {"type": "JSONModel(:sub_container) object"}}),
+    "sub_container": schema({
+        "top_container": ref("top_container"),
+        "type_2": {"type": "string", "dynamic_enum": "container_type"},
+        "indicator_2": {"type": "string", "maxLength": 255},
+        "barcode_2": {"type": "string", "maxLength": 255},
+        "type_3": {"type": "string", "dynamic_enum": "container_type"},
+        "indicator_3": {"type": "string", "maxLength": 255}}),
+    "note_text": schema({
+        "content": {"type": "string", "maxLength": 65000, "ifmissing": "error"},
+        "publish": {"type": "boolean"}}),
+    "note_singlepart": schema({
+        "label": {"type": "string", "maxLength": 65000},
+        "type": {"type": "string", "dynamic_enum": "note_singlepart_type", "ifmissing": "error"},
+        "content": {"type": "array", "items": {"type": "string", "maxLength": 65000}, "minItems": 1,
+                    "ifmissing": "error"},
+        "publish": {"type": "boolean"}}),
+    "note_multipart": schema({
+        "label": {"type": "string", "maxLength": 65000},
+        "type": {"type": "string", "dynamic_enum": "note_multipart_type", "ifmissing": "error"},
+        "subnotes": {"type": "array", "items": {"type": [{"type": "JSONModel(:note_text) object"}]}},
+        "publish": {"type": "boolean"}}),
+    "note_bibliography": schema({
+        "label": {"type": "string", "maxLength": 65000},
+        "content": {"type": "array", "items": {"type": "string", "maxLength": 65000}},
+        "items": {"type": "array", "items": {"type": "string", "maxLength": 65000}}}),
+}
+
+
+def now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def template(path):
+    return re.sub(r"(?<=/)\d+(?=/|$)", "{id}", path)
+
+
+class Backend(object):
+    """The records, sessions and request statistics of the stand-in server."""
+
+    def __init__(self, records=100, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.stats = Counter()
+        self.fail = [0, 503, None]
+        self.conflicts = 0
+        self.tables = {}
+        self.populate(records)
+
+    def populate(self, records):
+        created = "2024-01-01T00:00:00Z"
+        self.repositories = {REPO_ID: {"uri": f"/repositories/{REPO_ID}", "jsonmodel_type": "repository",
+                                       "repo_code": "BENCH", "name": "Benchmark repository",
+                                       "display_string": "Benchmark repository", "lock_version": 0}}
+        self.tables["container_profiles"] = {
+            i: {"uri": f"/container_profiles/{i}", "jsonmodel_type": "container_profile", "name": f"Profile {i}",
+                "display_string": f"Profile {i} [10w x 12h x 15d inches]", "dimension_units": "inches",
+                "width": "10", "height": "12", "depth": "15", "extent_dimension": "width", "lock_version": 0,
+                "system_mtime": created}
+            for i in range(1, 6)}
+        self.tables["top_containers"] = {
+            i: {"uri": f"/repositories/{REPO_ID}/top_containers/{i}", "jsonmodel_type": "top_container",
+                "indicator": str(i), "barcode": f"3{i:013d}", "type": "box",
+                "container_profile": {"ref": f"/container_profiles/{i % 5 + 1}"},
+                "repository": {"ref": f"/repositories/{REPO_ID}"}, "lock_version": 0, "system_mtime": created}
+            for i in range(1, records + 1)}
+        self.tables["resources"] = {
+            i: {"uri": f"/repositories/{REPO_ID}/resources/{i}", "jsonmodel_type": "resource",
+                "title": f"Collection {i}", "id_0": f"MS-{i:04d}", "level": "collection", "publish": False,
+                "extents": [{"jsonmodel_type": "extent", "portion": "whole", "number": "1",
+                             "extent_type": "linear_feet"}],
+                "dates": [{"jsonmodel_type": "date", "date_type": "inclusive", "label": "creation",
+                           "expression": "1900-1950"}],
+                "notes": [], "instances": [], "lang_materials": [], "lock_version": 0, "system_mtime": created}
+            for i in range(1, max(5, records // 10) + 1)}
+        self.tables["archival_objects"] = {
+            i: {"uri": f"/repositories/{REPO_ID}/archival_objects/{i}", "jsonmodel_type": "archival_object",
+                "title": f"File {i}", "level": "file", "component_id": f"F{i}",
+                "resource": {"ref": f"/repositories/{REPO_ID}/resources/{i % max(5, records // 10) + 1}"},
+                "instances": [], "notes": [], "lock_version": 0, "system_mtime": created}
+            for i in range(1, records + 1)}
+        self.enumerations = {1: {"uri": "/config/enumerations/1", "jsonmodel_type": "enumeration",
+                                 "name": "container_type", "editable": True, "enumeration_values": []}}
+        self.enumeration_values = {}
+        for i, value in enumerate(["box", "folder", "reel", "volume"], start=1):
+            record = {"uri": f"/config/enumeration_values/{i}", "jsonmodel_type": "enumeration_value", "id": i,
+                      "value": value, "position": i - 1, "suppressed": False, "readonly": False}
+            self.enumeration_values[i] = record
+            self.enumerations[1]["enumeration_values"].append(record)
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def injected_failure(self):
+        """The status (and Retry-After) of an injected failure for this request, if any."""
+        with self.lock:
+            if self.fail[0] > 0:
+                self.fail[0] -= 1
+                self.stats["injected errors"] += 1
+                return self.fail[1], self.fail[2]
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats["injected errors"] += 1
+                return 503, None
+        return None
+
+    def control(self, path, query):
+        if path == "/_mock/stats":
+            with self.lock:
+                return 200, dict(self.stats)
+        if path == "/_mock/expire":
+            with self.lock:
+                self.sessions.clear()
+            return 200, {"status": "expired"}
+        if path == "/_mock/fail":
+            with self.lock:
+                self.fail = [int(query.get("n", ["1"])[0]), int(query.get("status", ["503"])[0]),
+                             query.get("retry_after", [None])[0]]
+            return 200, {"status": "armed"}
+        if path == "/_mock/conflict":
+            with self.lock:
+                self.conflicts = int(query.get("n", ["1"])[0])
+            return 200, {"status": "armed"}
+        return 404, {"error": "Unknown control endpoint"}
+
+    def login(self):
+        with self.lock:
+            self.stats["logins"] += 1
+            token = hashlib.sha256(f"{time.time()}{self.random.random()}".encode()).hexdigest()
+            self.sessions.add(token)
+        return 200, {"session": token, "user": {"username": "admin"}}
+
+    def list_records(self, table, query):
+        ids = sorted(table)
+        if "modified_since" in query:
+            since = datetime.fromtimestamp(int(query["modified_since"][0]), timezone.utc)
+            since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+            ids = [i for i in ids if table[i]["system_mtime"] >= since]
+        if "all_ids" in query:
+            return 200, ids
+        if "id_set[]" in query or "id_set" in query:
+            wanted = [int(i) for value in query.get("id_set[]", []) + query.get("id_set", []) for i in value.split(",")]
+            return 200, [table[i] for i in wanted if i in table]
+        if "page" not in query:
+            return 400, {"error": {"page": ["Parameter required but no value provided"]}}
+        page = int(query["page"][0])
+        page_size = int(query.get("page_size", ["10"])[0])
+        last_page = max(1, -(-len(ids) // page_size))
+        results = [table[i] for i in ids[(page - 1) * page_size:page * page_size]]
+        return 200, {"first_page": 1, "last_page": last_page, "this_page": page, "total": len(ids),
+                     "results": results}
+
+    def create(self, table, uri_prefix, record):
+        with self.lock:
+            new_id = max(table, default=0) + 1
+            record = dict(record, uri=f"{uri_prefix}/{new_id}", lock_version=0, system_mtime=now())
+            table[new_id] = record
+        return 200, {"status": "Created", "id": new_id, "lock_version": 0, "warnings": [], "uri": record["uri"]}
+
+    def update(self, table, record_id, record):
+        with self.lock:
+            if record_id not in table:
+                return 404, {"error": "Record not found"}
+            current = table[record_id]
+            if self.conflicts > 0:
+                # Someone else saved the record since the client fetched it
+                self.conflicts -= 1
+                self.stats["conflicts"] += 1
+                current = table[record_id] = dict(current, lock_version=current["lock_version"] + 1)
+            if record.get("lock_version") != current.get("lock_version"):
+                return 409, {"error": "The record you tried to update has been modified since you fetched it."}
+            record = dict(record, uri=current["uri"], lock_version=current["lock_version"] + 1, system_mtime=now())
+            table[record_id] = record
+        return 200, {"status": "Updated", "id": record_id, "lock_version": record["lock_version"], "warnings": [],
+                     "uri": record["uri"]}
+
+    def batch_import(self, records):
+        """Create records with temporary 'import_' URIs, resolving references between them, in one transaction."""
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            return 400, {"error": "Expected a JSON array of records"}
+        pattern = re.compile(rf"/repositories/{REPO_ID}/(\w+)/import_\w+")
+        with self.lock:
+            saved = {}
+            next_ids = {kind: max(table, default=0) + 1 for kind, table in self.tables.items()}
+            for record in records:
+                match = pattern.fullmatch(record.get("uri", ""))
+                if match is None or REPO_TYPES.get(match[1]) != record.get("jsonmodel_type"):
+                    return 200, [{"errors": [f"Invalid import URI {record.get('uri')!r}"]}]
+                kind = match[1]
+                saved[record["uri"]] = [f"/repositories/{REPO_ID}/{kind}/{next_ids[kind]}", next_ids[kind]]
+                next_ids[kind] += 1
+
+            def resolve(value):
+                if isinstance(value, dict):
+                    ref = value.get("ref")
+                    if isinstance(ref, str) and "/import_" in ref and ref not in saved:
+                        raise KeyError(ref)
+                    return {k: saved[v][0] if k == "ref" and v in saved else resolve(v) for k, v in value.items()}
+                if isinstance(value, list):
+                    return [resolve(v) for v in value]
+                return value
+
+            try:
+                resolved = [resolve(dict(record, uri=saved[record["uri"]][0])) for record in records]
+            except KeyError as e:
+                return 200, [{"errors": [f"Reference to unknown record {e.args[0]}"]}]
+            for record in resolved:
+                kind, record_id = record["uri"].split("/")[-2:]
+                self.tables[kind][int(record_id)] = dict(record, lock_version=0, system_mtime=now())
+        return 200, [{"status": [{"type": "started", "label": "Starting import"}]}, {"saved": saved}]
+
+    def search_documents(self):
+        """The Solr documents of the records of the repository, as the search endpoint returns them."""
+        for kind, record_type in REPO_TYPES.items():
+            for record in self.tables[kind].values():
+                title = record.get("title") or f"{record.get('type', '')} {record.get('indicator', '')}"
+                yield {"id": record["uri"], "uri": record["uri"], "primary_type": record_type,
+                       "types": [record_type], "title": title.strip(), "repository": f"/repositories/{REPO_ID}",
+                       "publish": str(record.get("publish", False)).lower(), "system_mtime": record["system_mtime"],
+                       "json": json.dumps(record)}
+
+    def search(self, query):
+        """Search the records of the repository. Matching is much simpler than Solr's: the query's words (or
+        'field:value' terms) must all appear, ignoring case, in the record's JSON (or in that field)."""
+        if "page" not in query:
+            return 400, {"error": {"page": ["Parameter required but no value provided"]}}
+        types = set(query.get("type[]", []))
+        filters = [json.loads(term) for term in query.get("filter_term[]", [])]
+        terms = [term.lower().partition(":") if ":" in term else ("json", ":", term.lower())
+                 for term in query.get("q", ["*"])[0].split() if term not in ("*", "*:*")]
+        with self.lock:
+            hits = [doc for doc in self.search_documents()
+                    if (not types or doc["primary_type"] in types)
+                    and all(str(doc.get(field)) == str(value) for term in filters for field, value in term.items())
+                    and all(value.strip("*") in str(doc.get(field, "")).lower() for field, _, value in terms)]
+        page = int(query["page"][0])
+        page_size = min(int(query.get("page_size", ["10"])[0]), 250)
+        fields = query.get("fields[]")
+        results = hits[(page - 1) * page_size:page * page_size]
+        if fields:
+            results = [{field: doc[field] for field in fields if field in doc} for doc in results]
+        return 200, {"page_size": page_size, "first_page": 1, "last_page": max(1, -(-len(hits) // page_size)),
+                     "this_page": page, "offset_first": (page - 1) * page_size + 1,
+                     "offset_last": (page - 1) * page_size + len(results), "total_hits": len(hits),
+                     "results": results, "facets": {}}
+
+    def handle(self, method, path, query, body):
+        """Answer an authenticated API request with (status, JSON-serializable body)."""
+        if path == f"/repositories/{REPO_ID}/batch_imports" and method == "POST":
+            return self.batch_import(body)
+        if path == f"/repositories/{REPO_ID}/search" and method == "GET":
+            return self.search(query)
+        if path == "/version" and method == "GET":
+            return 200, VERSION
+        if path == "/schemas" and method == "GET":
+            return 200, SCHEMAS
+        if path == "/repositories" and method == "GET":
+            return 200, list(self.repositories.values())
+        match = re.fullmatch(r"/repositories/(\d+)", path)
+        if match:
+            repository = self.repositories.get(int(match[1]))
+            return (200, repository) if repository else (404, {"error": "Repository not found"})
+        match = re.fullmatch(r"/config/enumerations/(\d+)", path)
+        if match and method == "GET":
+            enumeration = self.enumerations.get(int(match[1]))
+            return (200, enumeration) if enumeration else (404, {"error": "Record not found"})
+        match = re.fullmatch(r"/config/enumeration_values/(\d+)(/suppressed)?", path)
+        if match:
+            value = self.enumeration_values.get(int(match[1]))
+            if value is None:
+                return 404, {"error": "Record not found"}
+            if method == "POST" and match[2]:
+                value["suppressed"] = query.get("suppressed", ["true"])[0] == "true"
+                return 200, {"status": "Suppressed" if value["suppressed"] else "Unsuppressed", "id": value["id"]}
+            return 200, value
+
+        match = re.fullmatch(rf"(/repositories/{REPO_ID})?/(\w+)(?:/(\d+))?", path)
+        if match is None:
+            return 404, {"error": "Not found"}
+        scope, kind, record_id = match.groups()
+        types = REPO_TYPES if scope else GLOBAL_TYPES
+        if kind not in types:
+            return 404, {"error": "Not found"}
+        table = self.tables[kind]
+        if method == "POST" and body.get("jsonmodel_type", types[kind]) != types[kind]:
+            return 400, {"error": {"jsonmodel_type": [f"must be {types[kind]}"]}}
+        if record_id is None:
+            if method == "GET":
+                return self.list_records(table, query)
+            return self.create(table, f"{scope or ''}/{kind}", body)
+        record_id = int(record_id)
+        if method == "GET":
+            record = table.get(record_id)
+            return (200, record) if record else (404, {"error": "Record not found"})
+        return self.update(table, record_id, body)
+
+
+class Handler(BaseHTTPRequestHandler):
+    backend = None
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately: without this, Nagle's algorithm and delayed ACKs add ~40 ms to
+        # every response on a kept-alive connection
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, payload, headers=None):
+        body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        if status == 200 and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain" if isinstance(payload, str) else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.command == "GET" and status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self):
+        backend = self.backend
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = "/" + url.path.strip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        if path.startswith("/_mock/"):
+            return self.send(*backend.control(path, query))
+
+        backend.delay()
+        with backend.lock:
+            backend.stats["requests"] += 1
+            backend.stats[f"{self.command} {template(path)}"] += 1
+        failure = backend.injected_failure()
+        if failure is not None:
+            status, retry_after = failure
+            return self.send(status, {"error": "Injected failure"},
+                             {"Retry-After": retry_after} if retry_after else None)
+        if re.fullmatch(r"/users/[^/]+/login", path) and self.command == "POST":
+            return self.send(*backend.login())
+        if self.headers.get(SESSION_HEADER) not in backend.sessions:
+            return self.send(412, {"code": "SESSION_GONE", "error": "No session found for the token"})
+        try:
+            body = json.loads(raw_body) if raw_body else None
+        except json.JSONDecodeError:
+            return self.send(400, {"error": "Had some trouble parsing your request"})
+        if self.command == "POST" and not isinstance(body, dict) and not path.endswith(("suppressed", "batch_imports")):
+            return self.send(400, {"error": "Expected a JSON object"})
+        self.send(*backend.handle(self.command, path, query, body))
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+
+class MockServer(object):
+    """The stand-in server, listening on 127.0.0.1 and serving from a background thread once started."""
+
+    def __init__(self, port=0, **options):
+        self.backend = Backend(**options)
+        handler = type("BoundHandler", (Handler,), {"backend": self.backend})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.backend.lock:
+            return Counter(self.backend.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay in seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random delay in seconds added on top")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503")
+    parser.add_argument("--records", type=int, default=100, help="Number of top containers and archival objects")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed, for reproducible jitter and errors")
+    args = parser.parse_args()
+
+    server = MockServer(args.port, records=args.records, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, seed=args.seed)
+    print(f"Serving a mock ArchivesSpace API on {server.url} (login with any username and password)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
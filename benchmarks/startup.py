@@ -0,0 +1,89 @@
+"""Startup benchmark for commands that should never touch the network.
+
+Runs each command several times in a fresh interpreter, with the ArchivesSnake configuration pointing at a local
+socket that counts incoming connections. Any connection means that a command which does not need the API is
+paying for an HTTP round trip at startup, and the benchmark fails. It also fails if the median wall time of a
+command exceeds the budget.
+
+    python benchmarks/startup.py [--runs N] [--budget MS]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+COMMANDS = [
+    ["--help"],
+    ["cache", "token", "clear"],
+    ["cache", "repository", "set", "2"],
+]
+
+
+class ConnectionCounter(object):
+    """A listening socket that accepts and immediately closes connections, counting them."""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.count = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.count += 1
+            conn.close()
+
+
+def make_env(home, port):
+    (home / ".archivessnake.yml").write_text(f"baseurl: http://127.0.0.1:{port}\n"
+                                             "username: bench\npassword: bench\n")
+    env = dict(os.environ)
+    env["HOME"] = str(home)
+    env["XDG_DATA_HOME"] = str(home / "data")
+    env.pop("ASNAKE_CONFIG_FILE", None)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per command")
+    parser.add_argument("--budget", type=float, default=600, help="Budget in milliseconds for the median wall time")
+    args = parser.parse_args()
+
+    counter = ConnectionCounter()
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        env = make_env(Path(tmp), counter.port)
+        for command in COMMANDS:
+            times = []
+            errors = 0
+            before = counter.count
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, "-m", "asp.main", *command], env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                times.append(time.perf_counter() - start)
+                errors += result.returncode != 0
+            connections = counter.count - before
+            print(f"asp {' '.join(command):<28} median {statistics.median(times) * 1000:7.1f} ms  "
+                  f"min {min(times) * 1000:7.1f} ms  connections {connections}  errors {errors}")
+            if connections or errors or statistics.median(times) * 1000 > args.budget:
+                failed = True
+
+    if failed:
+        print("FAIL: offline commands failed, opened connections to the API, or exceeded the budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-while IFS=',' read -r cid barcode nbarcode indicator profid; do
-  uv run containers.py edit $cid --repo 3 --profile $profid
-done < <(tail -n +2 new-profiles.csv)  # skips header row
+# new-profiles.csv has the columns cid,barcode,nbarcode,indicator,profid. Only the profile is changed, so pass the
+# container ID and profile columns to a single 'edit-batch' run instead of starting one process per row.
+{ echo "container_id,profile"; tail -n +2 new-profiles.csv | cut -d, -f1,5; } | asp container edit-batch --repo 3
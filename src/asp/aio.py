@@ -0,0 +1,205 @@
+import asyncio
+import copy
+import time
+from collections import deque
+
+import httpx
+
+import asp.config as appconfig
+from asp.config import APIError, CONFLICT, RETRY_STATUSES, RETRY_STATUSES_UNSAFE
+
+config = appconfig.config
+
+
+def _retryable_error(method, error):
+    """Whether a failed connection can be retried. POSTs are only retried if the request was never sent."""
+    if method == 'get':
+        return isinstance(error, httpx.TransportError)
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class AsyncAPI(object):
+    """Asynchronous client for the API, sharing the base URL, session token and tuning settings of config.client.
+
+    At most `concurrency` requests are in flight at once. When the session expires, concurrent requests that fail with
+    the same token trigger a single re-login, which also refreshes the token used by the synchronous client.
+    """
+
+    def __init__(self, concurrency):
+        client = config.client  # authenticates, if there is no stored token
+        self.header = client.config['session_header_name']
+        pool_size = config.setting('pool_size', 10, int)
+        keep_alive = config.setting('keep_alive', True, appconfig.to_bool)
+        self.http = httpx.AsyncClient(
+            base_url=client.config['baseurl'].rstrip('/') + '/',
+            headers=dict(client.session.headers),
+            timeout=httpx.Timeout(config.setting('read_timeout', 120.0, float),
+                                  connect=config.setting('connect_timeout', 10.0, float)),
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size if keep_alive else 0))
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.auth_lock = asyncio.Lock()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _reauthorize(self, stale_token, login=False):
+        async with self.auth_lock:
+            if self.http.headers.get(self.header) != stale_token:
+                return
+            await asyncio.to_thread(config.reauthorize, stale_token, login)
+            self.http.headers[self.header] = config.client.session.headers[self.header]
+
+    async def _send(self, method, endpoint, kwargs):
+        token = self.http.headers.get(self.header)
+        out = await self._call(method, endpoint, kwargs)
+        if out.status_code == 412:
+            await self._reauthorize(token)
+            token = self.http.headers.get(self.header)
+            out = await self._call(method, endpoint, kwargs)
+            if out.status_code == 412:
+                # The token adopted from the state file has expired too (e.g. the backend was restarted)
+                await self._reauthorize(token, login=True)
+                out = await self._call(method, endpoint, kwargs)
+        return out
+
+    async def _call(self, method, endpoint, kwargs):
+        tracer = config.tracer
+        if tracer is None:
+            return await self.http.request(method, endpoint.lstrip('/'), **kwargs)
+        start = time.perf_counter()
+        try:
+            out = await self.http.request(method, endpoint.lstrip('/'), **kwargs)
+        except Exception as e:
+            tracer.request('async', method, endpoint, 0, time.perf_counter() - start, 0, 0, error=repr(e))
+            raise
+        tracer.request('async', method, endpoint, out.status_code, time.perf_counter() - start,
+                       len(out.request.content), len(out.content))
+        return out
+
+    async def request(self, method, endpoint, params=None, **kwargs):
+        """Call the API with the same re-authentication and retry policy as AppConfig.request().
+
+        Returns the response, or raises APIError if the call did not succeed.
+        """
+        if params:
+            # ArchivesSpace uses the PHP convention of appending '[]' to the names of array-valued parameters
+            kwargs['params'] = {k + '[]' if isinstance(v, (list, tuple)) and not k.endswith('[]') else k: v
+                                for k, v in params.items()}
+        max_retries = config.setting('retries', 4, int)
+        statuses = RETRY_STATUSES if method == 'get' else RETRY_STATUSES_UNSAFE
+        for attempt in range(max_retries + 1):
+            async with self.semaphore:
+                try:
+                    out = await self._send(method, endpoint, kwargs)
+                except httpx.HTTPError as e:
+                    if attempt == max_retries or not _retryable_error(method, e):
+                        raise APIError(0, f'Connection failed: {e!r}')
+                    config.count_retry('connection')
+                    delay = config.retry_delay(attempt)
+                else:
+                    if out.status_code not in statuses or attempt == max_retries:
+                        break
+                    config.count_retry(str(out.status_code))
+                    delay = config.retry_delay(attempt, out)
+            # Back off without holding a slot, so that the other workers' requests go ahead meanwhile
+            await asyncio.sleep(delay)
+        if out.status_code != 200:
+            raise APIError(out.status_code, out.text)
+        return out
+
+    async def get_json(self, endpoint, params=None):
+        return (await self.request('get', endpoint, params=params)).json()
+
+    async def post_json(self, endpoint, json, params=None):
+        return (await self.request('post', endpoint, params=params, json=json)).json()
+
+    async def update(self, endpoint, mutate):
+        """Read a record, change it with mutate(record) and save it, resolving edit conflicts like
+        AppConfig.update()."""
+        max_conflicts = config.setting('conflict_retries', 3, int)
+        for attempt in range(max_conflicts + 1):
+            record = await self.get_json(endpoint)
+            original = copy.deepcopy(record)
+            result = mutate(record)
+            if record == original:
+                return result, None
+            try:
+                return result, await self.post_json(endpoint, record)
+            except APIError as e:
+                if e.status != CONFLICT or attempt == max_conflicts:
+                    raise
+                config.count_retry('conflict')
+
+
+async def amap(fn, items, limit):
+    """Apply the coroutine function fn to each item, keeping at most 2 * `limit` items scheduled at once.
+
+    Yields (item, result, error) tuples in input order, where error is the exception raised by fn (if any). Items are
+    consumed lazily, so arbitrarily long input streams are processed in bounded memory.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, asyncio.ensure_future(fn(item))))
+            if len(pending) >= 2 * max(1, limit):
+                yield await _collect(*pending.popleft())
+        while pending:
+            yield await _collect(*pending.popleft())
+    finally:
+        # The consumer stopped early: don't leave work running in the background
+        for _, task in pending:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+
+
+async def _collect(item, task):
+    try:
+        return item, await task, None
+    except Exception as e:
+        return item, None, e
+
+
+def run(fn, items, workers):
+    """Apply the coroutine function fn(api, item) to each item over a shared AsyncAPI, with at most `workers`
+    requests in flight.
+
+    This is a plain generator yielding (item, result, error) tuples in input order, so that synchronous command code can
+    consume and report results as they complete.
+    """
+    loop = asyncio.new_event_loop()
+    api = None
+    results = None
+    try:
+        api = AsyncAPI(workers)
+        results = amap(lambda item: fn(api, item), items, workers)
+        while True:
+            try:
+                yield loop.run_until_complete(anext(results))
+            except StopAsyncIteration:
+                break
+    finally:
+        if results is not None:
+            loop.run_until_complete(results.aclose())
+        if api is not None:
+            loop.run_until_complete(api.aclose())
+        loop.close()
+
+
+def get_all(endpoint, ids=None, page_size=100, workers=4):
+    """Yield the records of an index endpoint (all of them, or those with the given ids).
+
+    Records are fetched a page at a time with 'id_set', with at most `workers` pages in flight, so memory use is
+    bounded however many records there are.
+    """
+    if ids is None:
+        ids = config.request('get', endpoint, params={'all_ids': True}).json()
+    pages = (ids[i:i + page_size] for i in range(0, len(ids), page_size))
+
+    async def fetch(api, page):
+        return await api.get_json(endpoint, params={'id_set': page})
+
+    for _, records, error in run(fetch, pages, workers):
+        if error is not None:
+            raise error
+        yield from records
@@ -0,0 +1,129 @@
+import csv
+import json
+import re
+import sys
+from contextlib import contextmanager
+
+import asp.jobs as jobs
+
+
+@contextmanager
+def open_input(filename):
+    """Open an input file for reading, or use stdin (which is left open) if the filename is '-' or None."""
+    if filename is None or filename == '-':
+        yield sys.stdin
+        return
+    try:
+        f = open(filename, 'r', newline='')
+    except FileNotFoundError:
+        print(f"Input file '{filename}' not found", file=sys.stderr)
+        exit(1)
+    with f:
+        yield f
+
+
+def read_csv(filename):
+    """Stream the rows of a CSV file with a header row as dicts. Empty cells are returned as None."""
+    with open_input(filename) as f:
+        for row in csv.DictReader(f):
+            yield {k.strip(): (v.strip() or None) if v is not None else None for k, v in row.items() if k}
+
+
+def read_ids(filename):
+    """Stream record identifiers from a file (or stdin) with one identifier per line."""
+    with open_input(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.isdigit():
+                print(f"Invalid ID '{line}'", file=sys.stderr)
+                exit(1)
+            yield int(line)
+
+
+def read_records(filename):
+    """Read JSON records from a file (or stdin): either a single JSON document, or NDJSON with one record per line.
+
+    Yields (line number, record, error) tuples. A malformed NDJSON line is yielded with its error, so that the other
+    records can still be processed; a malformed single document is fatal.
+    """
+    with open_input(filename) as f:
+        line_number = 0
+        first = ''
+        for first in f:
+            line_number += 1
+            if first.strip():
+                break
+        try:
+            record = json.loads(first)
+        except json.JSONDecodeError:
+            # Not a complete document on one line: the whole input is a single (pretty-printed) document
+            try:
+                yield line_number, json.loads(first + f.read()), None
+            except json.JSONDecodeError:
+                print("Error decoding JSON from file. File might be corrupted.", file=sys.stderr)
+                exit(1)
+            return
+        yield line_number, record, None
+        for line in f:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line), None
+            except json.JSONDecodeError as e:
+                yield line_number, None, e
+
+
+def post_records(records, endpoint, repo, workers, jsonmodel_type=None):
+    """Post a stream of (line number, record, error) tuples, each to the URI given in the record itself.
+
+    Records are validated against the schema of their jsonmodel_type (by default) before they are posted. Each
+    record's 'uri' must match the endpoint pattern (e.g. 'repositories/{repo}/resources/{id}') and, if a repository
+    was specified, be in that repository. A tab-separated result line (line number, URI, status, error) is printed for
+    each record.
+    """
+    import asp.aio as aio  # only needed for NDJSON input; a single document is posted without loading httpx
+    import asp.schemas as schemas
+
+    records = jobs.pending(records, key=lambda item: item[0])
+    pattern = re.compile('/?' + re.escape(endpoint).replace(r'\{repo\}', r'(?P<repo>\d+)').replace(r'\{id\}', r'\d+'))
+
+    async def post(api, item):
+        _, record, error = item
+        if error is not None:
+            raise error
+        uri = record.get('uri') if isinstance(record, dict) else None
+        match = pattern.fullmatch(uri or '')
+        if match is None:
+            raise ValueError(f"Record 'uri' {uri!r} does not match '{endpoint}'")
+        if repo is not None and 'repo' in match.groupdict() and int(match['repo']) != repo:
+            raise ValueError(f"Record 'uri' {uri!r} is not in repository {repo}")
+        schemas.check(record, jsonmodel_type)
+        return await api.post_json(uri, record)
+
+    failed = False
+    for (line_number, record, _), _, error in aio.run(post, records, workers):
+        uri = record.get('uri') if isinstance(record, dict) else None
+        report(line_number, uri, error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
+
+
+def print_ndjson(record):
+    """Print a record as one compact line of JSON."""
+    print(json.dumps(record, separators=(',', ':')))
+
+
+def report(*fields, error=None):
+    """Print a tab-separated per-record result line: the record fields, the status, and the error message.
+
+    Successful records are also recorded in the journal of the running job, if any, keyed by their first field.
+    """
+    if error is None:
+        jobs.record(*fields)
+    status = 'ok' if error is None else 'error'
+    message = '' if error is None else ' '.join(str(error).split())
+    print('\t'.join('' if f is None else str(f) for f in (*fields, status, message)), flush=True)
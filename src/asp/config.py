@@ -1,72 +1,271 @@
+import copy
+import hashlib
+import os
+import random
+import shutil
 import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
 from pathlib import Path
 import json as jsonmod
 import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: state file updates are atomic, but not serialized between processes
+    fcntl = None
 
-import asnake.client.web_client
 import platformdirs
-from asnake.client import ASnakeClient
+
+# ArchivesSnake and requests take a large share of the startup time, so they are imported only when a command actually
+# needs the API ('asp.session' holds the code that depends on requests). Commands that work offline (cache management,
+# '--help') don't load them at all.
+
+
+class APIError(Exception):
+    def __init__(self, status, text):
+        self.status = status
+        self.text = text
+
+    def __str__(self):
+        if self.status == CONFLICT:
+            return f'Edit conflict: the record was modified by someone else since it was read ({self.text.strip()})'
+        if self.status >= 400:
+            return f'API call failed: {self.text}'
+        return f'API problem: {self.text}'
+
+
+# Statuses that indicate a transient failure, and the subset of those for which the request cannot have been processed
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_STATUSES_UNSAFE = {429, 503}
+# Status of an update whose 'lock_version' is stale, because the record was saved by someone else since it was read
+CONFLICT = 409
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off', '')
 
 
 class AppConfig(object):
     def __init__(self):
         self.datadir = Path(platformdirs.user_data_dir('asp'))
         self.state_file = self.datadir / 'cache.json'
+        self.state_lock_file = self.datadir / 'cache.json.lock'
+        self.http_cache_dir = self.datadir / 'http_cache'
         if not self.datadir.is_dir():
             Path(self.datadir).mkdir(parents=True, exist_ok=True)
 
-        # Read stored state once at initialization and assume it doesn't change for the duration of the process.
-        # This may not be the case if there is more than one concurrent process of this application, but it is a rather
-        # minimal risk.
+        # Read stored state once at initialization. Other processes of this application (e.g. under 'xargs -P') may
+        # change the state file while this one runs: the session token is re-read from disk whenever it expires, and
+        # only the keys changed by this process are merged back into the file at exit.
+        self.state = self._read_state()
+        self._saved_state = dict(self.state)
+
+        # The API client is created on first use, so that commands which never talk to the API (cache management,
+        # '--help', tab-completion) don't pay for authentication at startup.
+        self._client = None
+        self._asnake_config = None
+        self._auth_lock = threading.Lock()
+        self._retry_lock = threading.Lock()
+        self.retries = Counter()
+        self._tracer = None
+        self._trace_checked = False
+
+        atexit.register(self.save_state)
+        atexit.register(self.report_retries)
+        atexit.register(self.report_trace)
 
-        self.state = {}
+    def _read_state(self):
         try:
             with open(self.state_file, 'r') as f:
-                self.state = jsonmod.load(f)
+                return jsonmod.load(f)
         except FileNotFoundError:
-            pass
+            return {}
         except jsonmod.JSONDecodeError:
             print("Error decoding JSON from file. File might be corrupted.", file=sys.stderr)
+            return {}
+
+    def _write_state(self, state):
+        """Replace the state file atomically, so that concurrent readers never see a partially written file."""
+        tmp_path = self.state_file.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w') as f:
+            jsonmod.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    @contextmanager
+    def _state_locked(self):
+        """Hold an exclusive lock on the state file across processes while reading, changing and writing it."""
+        with open(self.state_lock_file, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reload_state(self):
+        """Re-read the state file, discarding unsaved changes. Used by long-running processes ('asp serve').
+
+        The client switches to the stored session token, which another process may have refreshed or cleared.
+        """
+        self.state = self._read_state()
+        self._saved_state = dict(self.state)
+        if self._client is not None:
+            token = self.state.get('token')
+            if token is None:
+                self._client = None  # log in again when the client is next used
+            else:
+                self._client.session.headers[self._client.config['session_header_name']] = token
+                self._client.config['session_token'] = token
+
+    def save_state(self):
+        """Merge the state changes made by this process into the state file.
+
+        The file is re-read under the lock, so that changes made meanwhile by other processes (such as a refreshed
+        session token) are kept unless this process changed the same key.
+        """
+        if self.state == self._saved_state:
+            return
+        try:
+            with self._state_locked():
+                state = self._read_state()
+                for key in self._saved_state.keys() - self.state.keys():
+                    state.pop(key, None)
+                for key, value in self.state.items():
+                    if self._saved_state.get(key) != value or key not in self._saved_state:
+                        state[key] = value
+                self._write_state(state)
+            self._saved_state = dict(self.state)
+        except OSError as e:
+            print(f"Error saving state: {e}", file=sys.stderr)
+
+    def _store_token(self, token):
+        """Record a new session token in memory and on disk, for other processes to pick up. Call with the state
+        lock held.
+        """
+        state = self._read_state()
+        state['token'] = token
+        try:
+            self._write_state(state)
+        except OSError as e:
+            print(f"Error saving state: {e}", file=sys.stderr)
+        self.state['token'] = token
+        self._saved_state['token'] = token
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._auth_lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def asnake_config(self):
+        """The ArchivesSnake configuration, read without creating (and authenticating) a client."""
+        if self._asnake_config is None:
+            import asnake.configurator
+            self._asnake_config = asnake.configurator.ASnakeConfig()
+        return self._asnake_config
+
+    @property
+    def tracer(self):
+        """The asp.trace.Tracer recording API calls if the ASP_TRACE setting is a destination ('-' for stderr, or a
+        file name), otherwise None.
+        """
+        if not self._trace_checked:
+            destination = self.setting('trace', None)
+            if destination and destination not in ('0', 'false', 'no', 'off'):
+                import asp.trace
+                self._tracer = asp.trace.Tracer(destination)
+            self._trace_checked = True
+        return self._tracer
+
+    def trace(self, event, **fields):
+        if self.tracer is not None:
+            self.tracer.event(event, **fields)
+
+    def report_trace(self):
+        """Print the summary of the traced API calls, and stop tracing (until the setting is checked again)."""
+        if self._tracer is not None:
+            self._tracer.summary()
+            self._tracer.close()
+        self._tracer = None
+        self._trace_checked = False
+
+    def setting(self, name, default, cast=str):
+        """Get a tuning setting from the ASP_<NAME> environment variable or, failing that, from the 'asp_<name>' key
+        in '.archivessnake.yml'.
+        """
+        value = os.environ.get(f'ASP_{name.upper()}')
+        if value is None:
+            value = self.asnake_config.get(f'asp_{name}')
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except ValueError:
+            print(f"Invalid value '{value}' for setting '{name}'", file=sys.stderr)
+            sys.exit(1)
+
+    def _configure_session(self, client):
+        """Replace the client's default requests session with one using the configured pool size, timeouts and
+        keep-alive behaviour. All API calls, from every command, go through this session.
+        """
+        import asp.session
+        timeout = (self.setting('connect_timeout', 10.0, float), self.setting('read_timeout', 120.0, float))
+        session = asp.session.make_session(self.setting('pool_size', 10, int), timeout)
+        session.headers.update(client.session.headers)
+        if not self.setting('keep_alive', True, to_bool):
+            session.headers['Connection'] = 'close'
+        client.session = session
+
+    def _connect(self):
+        import asnake.client.web_client
+        from asnake.client import ASnakeClient
 
         if 'token' in self.state:
-            self.client = ASnakeClient(username=None, password=None, session_token=self.state['token'])
-            self.client.authorize()
-        else:
-            asnake_file = Path.home() / '.archivessnake.yml'
-            if not asnake_file.is_file():
-                print("You are missing the '.achivessnake.yml' file in your home directory. "
-                      "This is required for authentication.", file=sys.stderr)
-                sys.exit(1)
+            client = ASnakeClient(username=None, password=None, session_token=self.state['token'])
+            self._configure_session(client)
+            client.authorize()
+            return client
+
+        asnake_file = Path.home() / '.archivessnake.yml'
+        if not asnake_file.is_file():
+            print("You are missing the '.achivessnake.yml' file in your home directory. "
+                  "This is required for authentication.", file=sys.stderr)
+            sys.exit(1)
+        with self._state_locked():
+            # Another process may have logged in while this one waited for the lock
+            token = self._read_state().get('token')
+            if token is not None:
+                self.state['token'] = self._saved_state['token'] = token
+                client = ASnakeClient(username=None, password=None, session_token=token)
+                self._configure_session(client)
+                client.authorize()
+                return client
+            start = time.perf_counter()
             try:
-                self.client = ASnakeClient()
-                self.client.authorize()
-                self.state['token'] = self.client.session.headers[self.client.config['session_header_name']]
+                client = ASnakeClient()
+                self._configure_session(client)
+                client.authorize()
             except asnake.client.web_client.ASnakeAuthError:
                 print("Failed to authenticate with the ArchivesSpace API. Please check your '.achivessnake.yml' file.",
                       file=sys.stderr)
                 sys.exit(1)
-
-        # Save state at application exit without using file locking.
-        #
-        # This, of course, could result in a race condition if more than one application process is running. However,
-        # the possibilities of that are so remote and of such low consequence that it's not worth dealing with.
-        #
-        # A race condition could arise in only two scenarios: 1) a user (or a shell script, perhaps) runs more than
-        # one simultaneous and contradictory instances of 'repository set' or 'resource set', or 2) the session token
-        # expires while more than one process of the app is running.
-        #
-        # The first situation is practically impossible to happen in normal operation by a normal user, so it can be
-        # discounted. The second situation is slightly more plausible, but any invalid/expired key will be cleared at
-        # the next time the application is run.
-
-        def save_state():
-            try:
-                with open(self.state_file, 'w') as f:
-                    jsonmod.dump(self.state, f, indent=2)
-            except IOError as e:
-                print(f"Error saving state: {e}", file=sys.stderr)
-
-        atexit.register(save_state)
+            self._store_token(client.session.headers[client.config['session_header_name']])
+            self.trace('login', ms=round((time.perf_counter() - start) * 1000, 3))
+        return client
 
     def clear_state(self, items):
         for item in items:
@@ -84,49 +283,268 @@ class AppConfig(object):
                 sys.exit(1)
         return value
 
-    def _redo(self, api_out):
-        if api_out.status_code == 412:
-            try:
-                self.client = ASnakeClient()
-                self.client.authorize()
-            except asnake.client.web_client.ASnakeAuthError:
-                print("Failed to authenticate with the ArchivesSpace API. Please check your '.achivessnake.yml' file.",
-                      file=sys.stderr)
-                sys.exit(1)
-            self.state['token'] = self.client.session.headers[self.client.config['session_header_name']]
-            return True
-        elif api_out.status_code >= 400:
-            print(f'API call failed: {api_out.text}', file=sys.stderr)
-            exit(1)
+    def _login(self):
+        """Log in with the credentials in '.archivessnake.yml' and return the new session token."""
+        from asnake.client import ASnakeClient
 
-        if api_out.status_code != 200:
-            print(f'API problem: {api_out.text}', file=sys.stderr)
-            exit(1)
+        client = ASnakeClient()
+        self._configure_session(client)
+        client.authorize()
+        return client.session.headers[client.config['session_header_name']]
 
-        if api_out.status_code == 200:
-            return False
+    def reauthorize(self, stale_token, login=False):
+        """Replace an expired session token.
 
-    def safe_get(self, endpoint):
-        out = self.client.get(endpoint)
-        if self._redo(out):
-            out = self.client.get(endpoint)
+        Concurrent requests that fail with the same expired token trigger only one login; the others pick up the
+        token obtained by the first. This holds across processes too: if another process has already stored a fresh
+        token in the state file, it is adopted instead of logging in again, unless `login` is set because an adopted
+        token turned out to be expired as well.
+        """
+        import asnake.client.web_client
+
+        header = self.client.config['session_header_name']
+        with self._auth_lock:
+            if self.client.session.headers.get(header) != stale_token:
+                return
+            start = time.perf_counter()
+            with self._state_locked():
+                token = self._read_state().get('token')
+                if login or token is None or token == stale_token:
+                    try:
+                        token = self._login()
+                    except asnake.client.web_client.ASnakeAuthError:
+                        raise APIError(401, "Failed to authenticate with the ArchivesSpace API. "
+                                            "Please check your '.achivessnake.yml' file.")
+                    self._store_token(token)
+                    self.trace('reauth', token='login', ms=round((time.perf_counter() - start) * 1000, 3))
+                else:
+                    self.state['token'] = self._saved_state['token'] = token
+                    self.trace('reauth', token='adopted', ms=round((time.perf_counter() - start) * 1000, 3))
+            self.client.session.headers[header] = token
+            self.client.config['session_token'] = token
+
+    def _send(self, method, endpoint, kwargs):
+        """Make one API call, re-authenticating if the session has expired."""
+        client = self.client
+        header = client.config['session_header_name']
+        token = client.session.headers.get(header)
+        out = self._call(client, method, endpoint, kwargs)
+        if out.status_code == 412:
+            self.reauthorize(token)
+            token = client.session.headers.get(header)
+            out = self._call(client, method, endpoint, kwargs)
+            if out.status_code == 412:
+                # The token adopted from the state file has expired too (e.g. the backend was restarted)
+                self.reauthorize(token, login=True)
+                out = self._call(client, method, endpoint, kwargs)
         return out
 
-    def safe_post(self, endpoint, json):
-        out = self.client.post(endpoint, json=json)
-        if self._redo(out):
-            out = self.client.post(endpoint, json=json)
+    def _call(self, client, method, endpoint, kwargs):
+        tracer = self.tracer
+        if tracer is None:
+            return getattr(client, method)(endpoint, **kwargs)
+        start = time.perf_counter()
+        try:
+            out = getattr(client, method)(endpoint, **kwargs)
+        except Exception as e:
+            tracer.request('sync', method, endpoint, 0, time.perf_counter() - start, 0, 0, error=repr(e))
+            raise
+        tracer.request('sync', method, endpoint, out.status_code, time.perf_counter() - start,
+                       len(out.request.body or b''), len(out.content))
         return out
 
+    def retry_delay(self, attempt, out=None):
+        """Seconds to wait before the next attempt: the server's Retry-After if given, otherwise exponential backoff
+        with full jitter.
+        """
+        import email.utils
+
+        max_delay = self.setting('retry_max_delay', 60.0, float)
+        retry_after = out.headers.get('Retry-After') if out is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_at = email.utils.parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), max_delay)
+        return random.uniform(0, min(max_delay, self.setting('retry_backoff', 0.5, float) * 2 ** attempt))
+
+    def count_retry(self, reason):
+        with self._retry_lock:
+            self.retries[reason] += 1
+        self.trace('retry', reason=reason)
+
+    def request(self, method, endpoint, **kwargs):
+        """Call the API, re-authenticating if the session has expired and retrying transient failures.
+
+        Rate limiting (429) and server errors (5xx) are retried with backoff, as are connection errors. POSTs, which
+        may not be safe to repeat, are only retried when the request cannot have been processed: on 429 and 503, and
+        when the connection could not be established.
+
+        Returns the response, or raises APIError if the call did not succeed.
+        """
+        import asp.session
+        import requests
+
+        max_retries = self.setting('retries', 4, int)
+        statuses = RETRY_STATUSES if method == 'get' else RETRY_STATUSES_UNSAFE
+        for attempt in range(max_retries + 1):
+            try:
+                out = self._send(method, endpoint, kwargs)
+            except requests.RequestException as e:
+                if attempt < max_retries and asp.session.retryable_error(method, e):
+                    self.count_retry('connection')
+                    time.sleep(self.retry_delay(attempt))
+                    continue
+                raise APIError(0, f'Connection failed: {e}')
+            if out.status_code in statuses and attempt < max_retries:
+                self.count_retry(str(out.status_code))
+                time.sleep(self.retry_delay(attempt, out))
+                continue
+            break
+        if out.status_code not in (200, 304):
+            raise APIError(out.status_code, out.text)
+        return out
+
+    def update(self, endpoint, mutate):
+        """Read a record, change it with mutate(record) and save it, resolving edit conflicts.
+
+        If the record was saved by someone else in the meantime, the update fails with 409 (its 'lock_version' is
+        stale): the record is then read again and the mutation re-applied to the new version, up to ASP_CONFLICT_RETRIES
+        times. mutate must therefore only depend on the record it is given. A record that the mutation leaves unchanged
+        is not saved.
+
+        Returns (the value returned by mutate, the decoded response of the update or None), or raises APIError.
+        """
+        max_conflicts = self.setting('conflict_retries', 3, int)
+        for attempt in range(max_conflicts + 1):
+            record = self.request('get', endpoint).json()
+            original = copy.deepcopy(record)
+            result = mutate(record)
+            if record == original:
+                return result, None
+            try:
+                return result, self.request('post', endpoint, json=record).json()
+            except APIError as e:
+                if e.status != CONFLICT or attempt == max_conflicts:
+                    raise
+                self.count_retry('conflict')
+
+    def safe_update(self, endpoint, mutate):
+        try:
+            return self.update(endpoint, mutate)
+        except APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+
+    def _http_cache_path(self, endpoint, params):
+        key = jsonmod.dumps([self.asnake_config['baseurl'], endpoint.lstrip('/'), params], sort_keys=True)
+        return self.http_cache_dir / (hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def cached_get(self, endpoint, params=None):
+        """GET the decoded JSON of a slow-changing endpoint through the on-disk response cache.
+
+        Responses younger than the ASP_HTTP_CACHE_TTL setting (in seconds) are served from disk. Older ones are
+        revalidated with If-None-Match/If-Modified-Since when the backend sent an ETag or Last-Modified header, and
+        refetched otherwise. A TTL of 0 disables the cache.
+        """
+        params = params or {}
+        ttl = self.setting('http_cache_ttl', 3600.0, float)
+        if ttl <= 0:
+            return self.request('get', endpoint, params=params).json()
+
+        path = self._http_cache_path(endpoint, params)
+        try:
+            with open(path, 'r') as f:
+                entry = jsonmod.load(f)
+        except (FileNotFoundError, jsonmod.JSONDecodeError):
+            entry = None
+        if entry is not None and time.time() - entry['time'] < ttl:
+            return jsonmod.loads(entry['body'])
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        out = self.request('get', endpoint, params=params, headers=headers)
+        if out.status_code == 304 and entry is not None:
+            entry['time'] = time.time()
+        else:
+            entry = {'endpoint': endpoint, 'params': params, 'time': time.time(), 'body': out.text,
+                     'etag': out.headers.get('ETag'), 'last_modified': out.headers.get('Last-Modified')}
+        self.http_cache_dir.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                jsonmod.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error saving HTTP cache: {e}", file=sys.stderr)
+        return jsonmod.loads(entry['body'])
+
+    def clear_http_cache(self):
+        if self.http_cache_dir.is_dir():
+            shutil.rmtree(self.http_cache_dir)
+
+    def get_paged(self, endpoint, params=None, page_size=100, cached=False):
+        """Yield every object from a paged API listing, optionally through the on-disk response cache."""
+        page = 1
+        while True:
+            page_params = dict(params or {}, page=page, page_size=page_size)
+            if cached:
+                page_json = self.cached_get(endpoint, page_params)
+            else:
+                page_json = self.request('get', endpoint, params=page_params).json()
+            yield from page_json['results']
+            if page_json['this_page'] >= page_json['last_page']:
+                return
+            page += 1
+
+    def report_retries(self):
+        failures = {reason: n for reason, n in self.retries.items() if reason != 'conflict'}
+        total = sum(failures.values())
+        if total:
+            details = ', '.join(f'{reason}: {n}' for reason, n in sorted(failures.items()))
+            print(f"Retried {total} API request(s) after transient failures ({details})", file=sys.stderr)
+        if self.retries['conflict']:
+            print(f"Re-applied {self.retries['conflict']} update(s) to records modified by someone else",
+                  file=sys.stderr)
+
+    def safe_get(self, endpoint, **kwargs):
+        try:
+            return self.request('get', endpoint, **kwargs)
+        except APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+
+    def safe_post(self, endpoint, json, **kwargs):
+        try:
+            return self.request('post', endpoint, json=json, **kwargs)
+        except APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+
 
 config = AppConfig()
 
 
-def simple_get(endpoint, id, repo):
+def simple_get(endpoint, id, repo, cached=False):
     if '{repo}' in endpoint:
         repo = config.get_default("repository", repo)
     if 'resource' in endpoint:
         id = config.get_default("resource", id)
+    if cached:
+        try:
+            return config.cached_get(endpoint.format(id=id, repo=repo))
+        except APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
     out = config.safe_get(endpoint.format(id=id, repo=repo))
     return jsonmod.loads(out.text)
 
@@ -136,18 +554,5 @@ def simple_post(new_json, endpoint, id, repo):
         repo = config.get_default("repository", repo)
     if 'resource' in endpoint:
         id = config.get_default("resource", id)
-
-    if new_json == '-':
-        new_json = jsonmod.load(sys.stdin)
-    elif new_json:  # i.e. a payload file has been specified
-        try:
-            with open(new_json, 'r') as f:
-                new_json = jsonmod.load(f)
-        except FileNotFoundError:
-            print("Note JSON file not found", file=sys.stderr)
-            exit(1)
-        except jsonmod.JSONDecodeError:
-            print("Error decoding JSON from file. File might be corrupted.", file=sys.stderr)
-            exit(1)
     out = config.safe_post(endpoint.format(id=id, repo=repo), json=new_json)
     return jsonmod.loads(out.text)
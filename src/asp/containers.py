@@ -1,18 +1,33 @@
 import json
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+import asp.aio as aio
+import asp.batch as batch
 import asp.config as appconfig
+import asp.jobs as jobs
+import asp.schemas as schemas
 
 config = appconfig.config
 
 
-def create(barcode, ctype, indicator, profile, repo, json_out):
+def create(barcode, ctype, indicator, profile, repo, json_out, from_file, workers):
+    if from_file:
+        create_batch(from_file, repo, workers)
+        return
+    if not indicator:
+        print("indicator cannot be empty", file=sys.stderr)
+        exit(1)
+
     repo = config.get_default("repository", repo)
-    top_container_json = {"indicator": indicator, "jsonmodel_type": "top_container", "active_restrictions": []}
-    if ctype:
-        top_container_json['type'] = ctype
-    if barcode:
-        top_container_json['barcode'] = barcode
-    if profile:
-        top_container_json['container_profile'] = {"ref": f"/container_profiles/{profile}"}
+    top_container_json = new_container_json(indicator, ctype, barcode, profile)
+    try:
+        schemas.check(top_container_json)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
 
     out = config.safe_post(f'/repositories/{repo}/top_containers', json=top_container_json)
     out_json = json.loads(out.text)
@@ -24,10 +39,69 @@ def create(barcode, ctype, indicator, profile, repo, json_out):
         print(out_json['id'])
 
 
-def edit(container_id, barcode, ctype, profile, repo, indicator):
+def new_container_json(indicator, ctype, barcode, profile):
+    top_container_json = {"indicator": indicator, "jsonmodel_type": "top_container", "active_restrictions": []}
+    if ctype:
+        top_container_json['type'] = ctype
+    if barcode:
+        top_container_json['barcode'] = barcode
+    if profile:
+        top_container_json['container_profile'] = {"ref": f"/container_profiles/{profile}"}
+    return top_container_json
+
+
+def create_batch(csv_file, repo, workers):
+    """Create many containers from a CSV file (or stdin) in one process.
+
+    The CSV must have a header row with an 'indicator' column and optional 'ctype', 'barcode' and 'profile' columns.
+    The identifier of each new container is printed as soon as it is created, in input order. If the CSV also has an
+    'object_id' column, it is passed through as 'container_id,object_id', which is the input expected by
+    'resource instance add'. Failed rows are reported on stderr.
+    """
     repo = config.get_default("repository", repo)
-    out = config.safe_get(f'repositories/{repo}/top_containers/{container_id}')
-    top_container_json = json.loads(out.text)
+
+    async def create_row(api, item):
+        _, row = item
+        if not row.get('indicator'):
+            raise ValueError("indicator cannot be empty")
+        top_container_json = new_container_json(row['indicator'], row.get('ctype'), row.get('barcode'),
+                                                row.get('profile'))
+        schemas.check(top_container_json)
+        return await api.post_json(f'/repositories/{repo}/top_containers', top_container_json)
+
+    failed = False
+    jobs.begin(stdin=csv_file == '-')
+    rows = jobs.pending(enumerate(batch.read_csv(csv_file), start=1), key=lambda item: item[0])
+    for (line, row), out_json, error in aio.run(create_row, rows, workers):
+        if error is not None:
+            print(f"Row {line}: {' '.join(str(error).split())}", file=sys.stderr)
+            failed = True
+            continue
+        jobs.record(line, out_json['id'])
+        if row.get('object_id'):
+            print(f"{out_json['id']},{row['object_id']}", flush=True)
+        else:
+            print(out_json['id'], flush=True)
+    if failed:
+        sys.exit(1)
+
+
+def edit(container_id, barcode, ctype, profile, repo, indicator, find_barcode):
+    repo = config.get_default("repository", repo)
+    if container_id is None:
+        if find_barcode is None:
+            print("No container_id or barcode specified", file=sys.stderr)
+            exit(1)
+        container_id = resolve_barcode(find_barcode, repo)
+    _, out_json = config.safe_update(f'repositories/{repo}/top_containers/{container_id}',
+                                     lambda record: apply_edits(record, barcode, ctype, profile, indicator))
+    if out_json is None:
+        print("The container already has these properties", file=sys.stderr)
+        return
+    print(json.dumps(out_json, indent=2))
+
+
+def apply_edits(top_container_json, barcode, ctype, profile, indicator):
     if profile:
         top_container_json['container_profile'] = {'ref': f'/container_profiles/{profile}'}
     if barcode:
@@ -37,9 +111,153 @@ def edit(container_id, barcode, ctype, profile, repo, indicator):
     if indicator:
         top_container_json['indicator'] = indicator
 
-    out = config.safe_post(f'/repositories/{repo}/top_containers/{container_id}', json=top_container_json)
-    out_json = json.loads(out.text)
-    print(json.dumps(out_json, indent=2))
+
+def edit_batch(csv_file, repo, workers):
+    """Edit many containers from a CSV file (or stdin) in one process.
+
+    The CSV must have a header row. The 'container_id' column is required; the 'barcode', 'ctype', 'indicator' and
+    'profile' columns are optional, and empty cells leave the corresponding property unchanged. A tab-separated result
+    line (container id, status, error) is printed for each row.
+    """
+    repo = config.get_default("repository", repo)
+
+    async def edit_row(api, row):
+        container_id = row.get('container_id')
+        if not container_id:
+            raise ValueError("container_id cannot be empty")
+        await api.update(f'repositories/{repo}/top_containers/{container_id}',
+                         lambda record: apply_edits(record, row.get('barcode'), row.get('ctype'), row.get('profile'),
+                                                    row.get('indicator')))
+
+    failed = False
+    jobs.begin(stdin=csv_file in (None, '-'))
+    rows = jobs.pending(batch.read_csv(csv_file), key=lambda row: row.get('container_id'))
+    for row, _, error in aio.run(edit_row, rows, workers):
+        batch.report(row.get('container_id'), error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
+
+
+def export(repo, page_size, workers):
+    """Stream every top container in a repository to stdout as NDJSON."""
+    repo = config.get_default("repository", repo)
+    try:
+        for record in aio.get_all(f'repositories/{repo}/top_containers', page_size=page_size, workers=workers):
+            batch.print_ndjson(record)
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS top_containers (
+    repo INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    barcode TEXT,
+    indicator TEXT,
+    type TEXT,
+    profile INTEGER,
+    system_mtime TEXT,
+    PRIMARY KEY (repo, id)
+);
+CREATE INDEX IF NOT EXISTS top_containers_barcode ON top_containers (repo, barcode);
+CREATE INDEX IF NOT EXISTS top_containers_indicator ON top_containers (repo, indicator);
+CREATE INDEX IF NOT EXISTS top_containers_profile ON top_containers (repo, profile);
+CREATE TABLE IF NOT EXISTS index_state (
+    repo INTEGER PRIMARY KEY,
+    baseurl TEXT NOT NULL,
+    last_mtime TEXT
+);
+"""
+
+
+@contextmanager
+def open_index():
+    """Open the container index, committing on success and closing it afterwards."""
+    db = sqlite3.connect(config.datadir / 'containers.sqlite')
+    try:
+        db.executescript(INDEX_SCHEMA)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def _profile_id(top_container_json):
+    ref = (top_container_json.get('container_profile') or {}).get('ref')
+    return int(ref.rsplit('/', 1)[1]) if ref else None
+
+
+def index_build(repo, full):
+    """Build or refresh the local index of top containers in a repository.
+
+    A refresh only pages through containers modified since the newest 'system_mtime' already in the index, and drops
+    containers that no longer exist. A full build (or a change of ArchivesSpace instance) re-reads every container.
+    """
+    repo = config.get_default("repository", repo)
+    baseurl = config.asnake_config['baseurl']
+    endpoint = f'repositories/{repo}/top_containers'
+    with open_index() as db:
+        state = db.execute('SELECT baseurl, last_mtime FROM index_state WHERE repo = ?', (repo,)).fetchone()
+        if full or state is None or state[0] != baseurl:
+            db.execute('DELETE FROM top_containers WHERE repo = ?', (repo,))
+            last_mtime = None
+        else:
+            last_mtime = state[1]
+
+        try:
+            params = {}
+            if last_mtime:
+                params['modified_since'] = int(datetime.fromisoformat(last_mtime).timestamp())
+            updated = 0
+            for container in config.get_paged(endpoint, params=params, page_size=250):
+                db.execute('INSERT OR REPLACE INTO top_containers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (repo, int(container['uri'].rsplit('/', 1)[1]), container.get('barcode'),
+                            container.get('indicator'), container.get('type'), _profile_id(container),
+                            container.get('system_mtime')))
+                if container.get('system_mtime') and (last_mtime is None or container['system_mtime'] > last_mtime):
+                    last_mtime = container['system_mtime']
+                updated += 1
+
+            current_ids = set(config.request('get', endpoint, params={'all_ids': True}).json())
+        except appconfig.APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+        indexed_ids = {row[0] for row in db.execute('SELECT id FROM top_containers WHERE repo = ?', (repo,))}
+        deleted = indexed_ids - current_ids
+        db.executemany('DELETE FROM top_containers WHERE repo = ? AND id = ?', [(repo, i) for i in deleted])
+        db.execute('INSERT OR REPLACE INTO index_state VALUES (?, ?, ?)', (repo, baseurl, last_mtime))
+    print(f"Indexed {updated} updated and {len(deleted)} deleted containers in repository {repo}", file=sys.stderr)
+
+
+def index_lookup(repo, barcode=None, indicator=None, profile=None):
+    """Return the identifiers of the indexed containers matching all the given criteria."""
+    repo = config.get_default("repository", repo)
+    clauses = ['repo = ?']
+    values = [repo]
+    for column, value in (('barcode', barcode), ('indicator', indicator), ('profile', profile)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            values.append(value)
+    with open_index() as db:
+        if db.execute('SELECT 1 FROM index_state WHERE repo = ?', (repo,)).fetchone() is None:
+            print(f"There is no container index for repository {repo}. Run 'asp container index build' first.",
+                  file=sys.stderr)
+            exit(1)
+        rows = db.execute(f'SELECT id FROM top_containers WHERE {" AND ".join(clauses)} ORDER BY id', values)
+        return [row[0] for row in rows]
+
+
+def resolve_barcode(barcode, repo):
+    """Find the identifier of the container with the given barcode using the local index."""
+    ids = index_lookup(repo, barcode=barcode)
+    if len(ids) != 1:
+        problem = "No container" if not ids else "More than one container"
+        print(f"{problem} with barcode '{barcode}' in the container index. If the index is out of date, "
+              f"refresh it with 'asp container index build'.", file=sys.stderr)
+        exit(1)
+    return ids[0]
 
 
 if __name__ == "__main__":
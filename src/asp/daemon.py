@@ -0,0 +1,329 @@
+import io
+import json
+import os
+import socket
+import queue
+import struct
+import sys
+import threading
+from pathlib import Path
+
+import platformdirs
+
+# This module is the 'asp' entry point. It only uses the standard library (and platformdirs), so that forwarding a
+# command to a running 'asp serve' daemon doesn't pay for importing the rest of the application.
+
+# Frames exchanged over the socket: a one-byte kind and a four-byte payload length, followed by the payload.
+#
+#   client -> daemon: HEADER (JSON: argv, cwd, environment, tty flags), START, STDIN (data; empty at end of file)
+#   daemon -> client: ACCEPT, STDOUT, STDERR (data), READ (number of bytes wanted from stdin), EXIT (exit code)
+#
+# The daemon runs one command at a time. While it is busy, it closes new connections without accepting them, and their
+# commands run in their own process. A command only starts once the client has confirmed (START) that it got ACCEPT,
+# so that a client which gave up waiting doesn't run its command twice.
+HEADER, START, STDIN, ACCEPT, STDOUT, STDERR, READ, EXIT = (bytes([kind]) for kind in b'HSIAOERX')
+
+# Seconds that a client waits for the daemon to connect and accept a command, before running it in its own process
+ACCEPT_TIMEOUT = 5.0
+
+# Environment variables of the client that are applied while the daemon runs its command
+FORWARDED_ENV = ('COLUMNS', 'LINES', 'NO_COLOR')
+
+
+def socket_path():
+    return Path(platformdirs.user_data_dir('asp')) / 'daemon.sock'
+
+
+def _send(sock, kind, payload=b''):
+    sock.sendall(kind + struct.pack('!I', len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Connection to the asp daemon closed")
+        data += chunk
+    return data
+
+
+def _recv(sock):
+    kind, size = struct.unpack('!cI', _recv_exactly(sock, 5))
+    return kind, _recv_exactly(sock, size)
+
+
+def _accepted(sock, header):
+    """Send the request header, and return whether the daemon accepted it."""
+    try:
+        _send(sock, HEADER, json.dumps(header).encode())
+        kind, _ = _recv(sock)
+        if kind != ACCEPT:
+            return False
+        _send(sock, START)
+    except (OSError, EOFError):
+        return False
+    finally:
+        sock.settimeout(None)
+    return True
+
+
+def _connect():
+    path = socket_path()
+    if not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(ACCEPT_TIMEOUT)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def forward(argv):
+    """Run a command in the running daemon, relaying stdin, stdout and stderr.
+
+    Returns the command's exit code, or None if no daemon accepted the command (so it should run in this process).
+    """
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock:
+        header = {'argv': argv, 'cwd': os.getcwd(),
+                  'env': {k: v for k, v in os.environ.items() if k.startswith('ASP_') or k in FORWARDED_ENV},
+                  'tty': [stream.isatty() for stream in (sys.stdin, sys.stdout, sys.stderr)]}
+        if not _accepted(sock, header):
+            return None
+        try:
+            while True:
+                kind, data = _recv(sock)
+                if kind == STDOUT:
+                    sys.stdout.buffer.write(data)
+                    sys.stdout.buffer.flush()
+                elif kind == STDERR:
+                    sys.stderr.buffer.write(data)
+                    sys.stderr.buffer.flush()
+                elif kind == READ:
+                    try:
+                        data = os.read(sys.stdin.fileno(), struct.unpack('!I', data)[0])
+                    except (OSError, ValueError):
+                        data = b''
+                    _send(sock, STDIN, data)
+                elif kind == EXIT:
+                    return int(data)
+        except (EOFError, ConnectionResetError):
+            print("The asp daemon stopped before the command finished", file=sys.stderr)
+            return 1
+
+
+def main():
+    """Run asp: in the 'asp serve' daemon if one is running, otherwise in this process."""
+    argv = sys.argv[1:]
+    # '--trace[=FILE]' before the command is a global option. It is passed on (also to the daemon) as the ASP_TRACE
+    # setting, so that the command line parser never sees it.
+    while argv[:1] == ['--trace'] or argv and argv[0].startswith('--trace='):
+        os.environ['ASP_TRACE'] = argv.pop(0).partition('=')[2] or '-'
+    sys.argv[1:] = argv
+    if argv[:1] != ['serve'] and hasattr(socket, 'AF_UNIX') and not os.environ.get('ASP_NO_DAEMON'):
+        try:
+            code = forward(argv)
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        if code is not None:
+            sys.exit(code)
+
+    import asp.main
+    asp.main.main()
+
+
+class _RemoteInput(io.RawIOBase):
+    """The client's stdin, read over the socket on demand."""
+
+    def __init__(self, sock, tty):
+        self.sock = sock
+        self.tty = tty
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def readinto(self, buffer):
+        _send(self.sock, READ, struct.pack('!I', len(buffer)))
+        kind, data = _recv(self.sock)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _RemoteOutput(io.RawIOBase):
+    """The client's stdout or stderr, written over the socket."""
+
+    def __init__(self, sock, kind, tty):
+        self.sock = sock
+        self.kind = kind
+        self.tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        _send(self.sock, self.kind, bytes(data))
+        return len(data)
+
+
+def run_command(app, tokens):
+    """Run a command line with the cyclopts app, returning the exit code."""
+    try:
+        app(tokens)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception as e:
+        print(f"Error: {e!r}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _handle(app, sock, header):
+    """Run one forwarded command, with the standard streams, working directory and settings of the client."""
+    import asp.config as appconfig
+    config = appconfig.config
+
+    stdin_tty, stdout_tty, stderr_tty = header['tty']
+    streams = (sys.stdin, sys.stdout, sys.stderr)
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    sys.stdin = io.TextIOWrapper(io.BufferedReader(_RemoteInput(sock, stdin_tty)), encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(_RemoteOutput(sock, STDOUT, stdout_tty)), encoding='utf-8',
+                                  line_buffering=stdout_tty)
+    sys.stderr = io.TextIOWrapper(io.BufferedWriter(_RemoteOutput(sock, STDERR, stderr_tty)), encoding='utf-8',
+                                  line_buffering=True)
+    try:
+        for key in [k for k in os.environ if k.startswith('ASP_') or k in FORWARDED_ENV]:
+            del os.environ[key]
+        os.environ.update(header['env'])
+        os.chdir(header['cwd'])
+        # Other processes may have changed the defaults since the last command
+        config.reload_state()
+        code = run_command(app, header['argv'])
+        config.save_state()
+        config.report_retries()
+        config.retries.clear()
+        config.report_trace()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send(sock, EXIT, str(code).encode())
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+
+
+def _detach():
+    """Continue in a background process, detached from the terminal. Returns False in the original process."""
+    if os.fork():
+        return False
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    return True
+
+
+def _accept_loop(listener, accepted, busy):
+    """Accept connections, passing on a command to the main thread if it is idle, and refusing it otherwise."""
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:  # the listener was closed
+            return
+        try:
+            conn.settimeout(ACCEPT_TIMEOUT)
+            kind, data = _recv(conn)
+            header = json.loads(data) if kind == HEADER else None
+            if header is None or not (header.get('stop') or busy.acquire(blocking=False)):
+                conn.close()
+                continue
+            _send(conn, ACCEPT)
+            accepted.put((conn, header))
+        except (OSError, EOFError, ValueError):
+            conn.close()
+
+
+def serve(app, idle_timeout, foreground, stop):
+    """Serve commands forwarded by 'asp' over a Unix socket until idle for `idle_timeout` seconds.
+
+    Commands are run one at a time, in this process, so the API session, its connection pool and the loaded
+    configuration are reused from one command to the next. Commands forwarded while one is running are refused, so
+    that they run in their own process rather than wait for it.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        print("'asp serve' is not supported on this platform", file=sys.stderr)
+        sys.exit(1)
+    path = socket_path()
+    sock = _connect()
+    if stop:
+        if sock is None:
+            print("The asp daemon is not running", file=sys.stderr)
+            sys.exit(1)
+        with sock:
+            _accepted(sock, {'stop': True})
+        return
+    if sock is not None:
+        sock.close()
+        print(f"The asp daemon is already running on {path}", file=sys.stderr)
+        sys.exit(1)
+
+    import asp.config as appconfig
+    if idle_timeout is None:
+        idle_timeout = appconfig.config.setting('serve_idle_timeout', 900.0, float)
+
+    path.unlink(missing_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The daemon runs commands with our API session: don't let other users connect to it
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(str(path))
+    finally:
+        os.umask(old_umask)
+    listener.listen()
+    if not foreground:
+        if not _detach():
+            listener.close()
+            print(f"Started the asp daemon on {path}")
+            return
+
+    accepted = queue.Queue()
+    busy = threading.Lock()  # held from accepting a command until it has run
+    threading.Thread(target=_accept_loop, args=(listener, accepted, busy), daemon=True).start()
+    try:
+        while True:
+            try:
+                conn, header = accepted.get(timeout=idle_timeout if idle_timeout > 0 else None)
+            except queue.Empty:
+                break
+            with conn:
+                if header.get('stop'):
+                    break
+                try:
+                    if _recv(conn)[0] == START:
+                        conn.settimeout(None)
+                        _handle(app, conn, header)
+                except (OSError, EOFError, ValueError):
+                    # The client went away (e.g. interrupted with Ctrl-C): carry on with the next one
+                    continue
+                finally:
+                    busy.release()
+    finally:
+        listener.close()
+        path.unlink(missing_ok=True)
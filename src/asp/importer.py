@@ -0,0 +1,205 @@
+import itertools
+import json
+import sys
+
+import asp.batch as batch
+import asp.config as appconfig
+import asp.containers as containers
+import asp.jobs as jobs
+import asp.resources as resources
+import asp.schemas as schemas
+
+config = appconfig.config
+
+CONTAINER_COLUMNS = ('indicator', 'ctype', 'barcode', 'profile')
+
+
+def read_rows(filename, csv_input):
+    """Yield (row number, row dict, error) from a CSV file with a header row, or (line number, row dict, error) from
+    NDJSON with one flat JSON object per line. NDJSON values are converted to strings, and empty values to None, as
+    they are for CSV.
+    """
+    if csv_input:
+        for line, row in enumerate(batch.read_csv(filename), start=1):
+            yield line, row, None
+        return
+    for line, record, error in batch.read_records(filename):
+        if error is None and not isinstance(record, dict):
+            error = ValueError("Expected a JSON object")
+        if error is not None:
+            yield line, None, error
+            continue
+        yield line, {k: str(v).strip() or None if v is not None else None for k, v in record.items()}, None
+
+
+def container_key(row):
+    """Rows describing the same new container (same barcode or, without one, same type, indicator and profile)
+    share a single container."""
+    if row.get('barcode'):
+        return 'barcode', row['barcode']
+    return tuple(row.get(column) for column in CONTAINER_COLUMNS)
+
+
+def archival_object_json(row, repo, default_resource):
+    resource = row.get('resource') or default_resource
+    if resource is None:
+        raise ValueError("No resource specified for the archival object")
+    object_json = {"jsonmodel_type": "archival_object", "title": row['title'], "level": row.get('level') or "file",
+                   "resource": {"ref": f"/repositories/{repo}/resources/{resource}"}, "instances": []}
+    if row.get('component_id'):
+        object_json['component_id'] = row['component_id']
+    if row.get('parent'):
+        object_json['parent'] = {"ref": f"/repositories/{repo}/archival_objects/{row['parent']}"}
+    return object_json
+
+
+class Chunk(object):
+    """The records of one batch_imports request, with temporary URIs linking the containers, archival objects and
+    instances of its rows."""
+
+    def __init__(self, repo, created):
+        self.repo = repo
+        self.created = created  # container key -> ID of containers created by earlier chunks
+        self.records = []
+        self.new_containers = {}  # container key -> temporary URI
+        self.rows = []  # (line, container reference, archival object temporary URI, error)
+
+    def temporary_uri(self, record_type):
+        return f"/repositories/{self.repo}/{record_type}/import_{len(self.records) + 1}"
+
+    def container_ref(self, row):
+        if row.get('container_id'):
+            return None, f"/repositories/{self.repo}/top_containers/{row['container_id']}"
+        if not row.get('indicator'):
+            return None, None
+        key = container_key(row)
+        if key in self.created:
+            return key, f"/repositories/{self.repo}/top_containers/{self.created[key]}"
+        if key not in self.new_containers:
+            container_json = containers.new_container_json(row['indicator'], row.get('ctype'), row.get('barcode'),
+                                                           row.get('profile'))
+            schemas.check(container_json)
+            container_json['uri'] = self.temporary_uri('top_containers')
+            self.records.append(container_json)
+            self.new_containers[key] = container_json['uri']
+        return key, self.new_containers[key]
+
+    def add(self, line, row, default_resource):
+        """Add the records described by a row. Raises ValueError if the row is invalid."""
+        if not row.get('title') and not (row.get('indicator') or row.get('container_id')):
+            raise ValueError("Row has neither a 'title' (for an archival object) nor an 'indicator' or "
+                             "'container_id' (for a container)")
+        object_json = archival_object_json(row, self.repo, default_resource) if row.get('title') else None
+        if object_json is not None:
+            schemas.check(object_json)
+        _, ref = self.container_ref(row)
+        object_uri = None
+        if object_json is not None:
+            if ref is not None:
+                instance = resources.instance_json(self.repo, 0, row.get('itype') or "mixed_materials",
+                                                   row.get('type2'), row.get('indicator2'), row.get('barcode2'),
+                                                   row.get('type3'), row.get('indicator3'))
+                instance['sub_container']['top_container']['ref'] = ref
+                object_json['instances'].append(instance)
+            object_uri = object_json['uri'] = self.temporary_uri('archival_objects')
+            self.records.append(object_json)
+        self.rows.append((line, ref, object_uri, None))
+
+    def reject(self, line, error):
+        self.rows.append((line, None, None, error))
+
+    def _post(self):
+        """Post the records to batch_imports, returning the mapping of temporary URIs to [URI, ID]."""
+        out = config.request('post', f'repositories/{self.repo}/batch_imports', json=self.records)
+        results = json.loads(out.text)
+        if isinstance(results, dict):
+            results = [results]
+        saved = {}
+        for result in results:
+            if result.get('errors'):
+                raise appconfig.APIError(out.status_code, json.dumps(result['errors']))
+            saved.update(result.get('saved') or {})
+        missing = [record['uri'] for record in self.records if record['uri'] not in saved]
+        if missing:
+            raise appconfig.APIError(out.status_code, f"Records {', '.join(missing)} were not saved")
+        return saved
+
+    def submit(self):
+        """Import the chunk, and yield (line, container ID, archival object ID, error) for each row in input order."""
+        try:
+            saved = self._post() if self.records else {}
+        except appconfig.APIError as e:
+            # The chunk is imported in one transaction, so none of its records were created
+            for line, _, _, error in self.rows:
+                yield line, None, None, error or e
+            return
+
+        def record_id(uri):
+            if uri is None:
+                return None
+            return saved[uri][1] if uri in saved else int(uri.rsplit('/', 1)[1])
+
+        for key, uri in self.new_containers.items():
+            self.created[key] = record_id(uri)
+        for line, ref, object_uri, error in self.rows:
+            yield line, record_id(ref), record_id(object_uri), error
+
+
+def imported_containers(input_file, csv_input):
+    """The containers created by the rows that earlier runs of the job imported, by container key."""
+    created = {}
+    if jobs.current is None or not jobs.current.completed:
+        return created
+    for line, row, _ in read_rows(input_file, csv_input):
+        done = jobs.completed(line)
+        if done is not None and done[0] is not None and row.get('indicator') and not row.get('container_id'):
+            created.setdefault(container_key(row), done[0])
+    if input_file is None or input_file == '-':
+        sys.stdin.seek(0)
+    return created
+
+
+def batch_import(input_file, repo, csv_input, chunk_size):
+    """Create top containers and archival objects, linked by instances, with the batch_imports endpoint.
+
+    Each row (of a CSV file, or NDJSON with one flat object per line) describes a new archival object ('title' and
+    optional 'level', 'component_id', 'resource' and 'parent' columns), a new top container ('indicator' and optional
+    'ctype', 'barcode' and 'profile' columns) or an existing one ('container_id'), or both, in which case the object
+    gets an instance of the container ('itype', 'type2', 'indicator2', 'barcode2', 'type3' and 'indicator3' columns).
+    Rows with the same barcode (or, without one, the same type, indicator and profile) share one container.
+
+    The rows are imported `chunk_size` at a time, each chunk in a single server-side transaction. A tab-separated result
+    line (input row or line number, container ID, archival object ID, status, error) is printed for each row.
+    """
+    if chunk_size < 1:
+        print("The chunk size must be at least 1", file=sys.stderr)
+        exit(1)
+    repo = config.get_default("repository", repo)
+    default_resource = config.state.get("resource")
+    if input_file is not None and input_file != '-' and input_file.lower().endswith('.csv'):
+        csv_input = True
+
+    failed = False
+    jobs.begin(stdin=input_file in (None, '-'))
+    # Rows imported by an earlier run of the job are skipped, but the remaining rows may share their containers
+    created = imported_containers(input_file, csv_input)
+    rows = jobs.pending(read_rows(input_file, csv_input), key=lambda item: item[0])
+    while True:
+        chunk = Chunk(repo, created)
+        count = 0
+        for line, row, error in itertools.islice(rows, chunk_size):
+            count += 1
+            if error is None:
+                try:
+                    chunk.add(line, row, default_resource)
+                    continue
+                except ValueError as e:
+                    error = e
+            chunk.reject(line, error)
+        for line, container_id, object_id, error in chunk.submit():
+            batch.report(line, container_id, object_id, error=error)
+            failed = failed or error is not None
+        if count < chunk_size:
+            break
+    if failed:
+        sys.exit(1)
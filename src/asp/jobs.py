@@ -0,0 +1,332 @@
+import io
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: a job can be resumed while it is still running
+    fcntl = None
+
+import asp.config as appconfig
+
+config = appconfig.config
+
+# Commands that work on many records journal each item they complete, so that a run which is interrupted (or in which
+# some items fail) can be resumed with 'asp job resume', skipping the work already done. A job is a directory in the
+# data dir, named after its number:
+#
+#   job.json       the command, its parameters and working directory, and the status of the last run
+#   journal.jsonl  one line per completed item: its key (row number or record ID) and result fields
+#   input          a copy of the command's stdin, if it read its input from there, written as it is read
+#
+# A job is deleted when a run completes without errors, since there is nothing left to resume.
+
+_command = None  # (spec, parameters) of the running command, set by running()
+_resuming = None  # the Job that 'asp job resume' is running again
+current = None  # the Job journaling the running command, once it has called begin()
+
+
+def jobs_dir():
+    return config.datadir / 'jobs'
+
+
+def _describe(spec, parameters):
+    words = [word for word in (spec['noun'], spec['noun2'], spec['verb']) if word]
+    for name, value in parameters.items():
+        if value is None or value is False:
+            continue
+        option = '--' + name.replace('_', '-')
+        if value is True:
+            words.append(option)
+        else:
+            words.extend(f'{option}={v}' for v in (value if isinstance(value, list) else [value]))
+    return ' '.join(words)
+
+
+class _Tee(io.TextIOBase):
+    """The command's stdin, copied into the job's input file line by line as the command reads it, so that the
+    command still processes its input as it arrives."""
+
+    def __init__(self, stream, copy):
+        self.stream = stream
+        self.copy = copy
+        self.complete = False
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def _copied(self, data, complete):
+        self.copy.write(data)
+        self.copy.flush()
+        self.complete = self.complete or complete
+        return data
+
+    def readline(self, size=-1):
+        line = self.stream.readline(size)
+        return self._copied(line, not line and size != 0)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        return self._copied(data, size is None or size < 0 or not data and size != 0)
+
+    def drain(self):
+        """Copy the rest of stdin, so that the job can be resumed with all of its input."""
+        if not self.complete:
+            shutil.copyfileobj(self.stream, self.copy)
+            self.complete = True
+
+    def close(self):
+        self.copy.close()
+        super().close()
+
+
+class Job(object):
+    def __init__(self, path):
+        self.path = path
+        self.id = int(path.name)
+        with open(path / 'job.json', 'r') as f:
+            self.info = json.load(f)
+        self.completed = {}
+        self.skipped = 0
+        self.journal = None
+        self.input = None  # the _Tee copying stdin, in the run that created the job
+
+    @classmethod
+    def create(cls, spec, parameters):
+        root = jobs_dir()
+        root.mkdir(exist_ok=True)
+        job_id = max((int(p.name) for p in root.iterdir() if p.name.isdigit()), default=0) + 1
+        while True:
+            try:
+                (root / str(job_id)).mkdir()
+                break
+            except FileExistsError:  # created concurrently by another process
+                job_id += 1
+        path = root / str(job_id)
+        info = {'command': spec['command'], 'parameters': parameters, 'cwd': os.getcwd(), 'created': time.time(),
+                'description': _describe(spec, parameters), 'status': 'running', 'stdin': False}
+        with open(path / 'job.json', 'w') as f:
+            json.dump(info, f)
+        return cls(path)
+
+    def _save_info(self):
+        tmp_path = self.path / f'job.json.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.info, f)
+        os.replace(tmp_path, self.path / 'job.json')
+
+    def count(self):
+        """The number of items completed so far."""
+        try:
+            with open(self.path / 'journal.jsonl', 'rb') as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    def open(self):
+        """Open the journal for appending, and load the items completed by earlier runs.
+
+        Returns False if another process is running the job.
+        """
+        self.journal = open(self.path / 'journal.jsonl', 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.journal.close()
+                self.journal = None
+                return False
+        self.journal.seek(0)
+        for line in self.journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # the last line of a run that was killed while writing it
+            self.completed[entry['key']] = entry['fields']
+        return True
+
+    def running(self):
+        """Whether another process is running the job."""
+        if fcntl is None:
+            return False
+        with open(self.path / 'journal.jsonl', 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+        return False
+
+    def record(self, key, fields):
+        self.journal.write(json.dumps({'key': key, 'fields': fields}) + '\n')
+        self.journal.flush()
+
+    def finish(self, code):
+        if self.skipped:
+            print(f"Skipped {self.skipped} item(s) completed by an earlier run of job {self.id}", file=sys.stderr)
+        self.journal.close()
+        if code == 0:
+            if self.input is not None:
+                self.input.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        if self.input is not None:
+            self.input.drain()
+            self.input.close()
+            self.info['input_complete'] = True
+        self.info['status'] = 'failed'
+        self._save_info()
+        print(f"Job {self.id} did not complete: 'asp job resume {self.id}' retries the failed and remaining items",
+              file=sys.stderr)
+
+
+@contextmanager
+def running(spec, parameters):
+    """Run a command, finishing the job it started (if any) when it exits."""
+    global _command, current
+    saved = _command, current, sys.stdin
+    _command, current = (spec, parameters), None
+    code = 1
+    try:
+        yield
+        code = 0
+    except SystemExit as e:
+        code = 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+        raise
+    finally:
+        if current is not None:
+            current.finish(code)
+        if sys.stdin is not saved[2]:
+            sys.stdin.close()
+        _command, current, sys.stdin = saved
+
+
+def begin(stdin=False, **pinned):
+    """Journal the running command, which is about to process many items. If it reads its input from stdin, the input
+    is copied into the job directory as it is read, and a resumed run reads it from there. Parameter values that the
+    command resolved itself (e.g. the latest of something) can be given as keyword arguments, to be saved with the job.
+    """
+    global current, _resuming
+    if _command is None or current is not None:
+        return
+    spec, parameters = _command
+    if _resuming is not None:
+        current, _resuming = _resuming, None
+        if current.info['stdin']:
+            if not current.info.get('input_complete', True):
+                print(f"Job {current.id} was interrupted before it read all of its input: only the input read until "
+                      f"then is processed", file=sys.stderr)
+            sys.stdin = open(current.path / 'input', 'r', newline='')
+        return
+    if parameters.get('repo', 0) is None:
+        # Resume in the same repository, even if the default has changed since
+        parameters['repo'] = config.state.get('repository')
+    parameters.update(pinned)
+    job = Job.create(spec, parameters)
+    if stdin:
+        job.info['stdin'] = True
+        job.info['input_complete'] = False
+        job._save_info()
+        job.input = sys.stdin = _Tee(sys.stdin, open(job.path / 'input', 'w', newline=''))
+    job.open()
+    current = job
+
+
+def cancel():
+    """Stop journaling the running command, which turned out to process a single item, and delete its job."""
+    global current
+    if current is not None:
+        current.journal.close()
+        shutil.rmtree(current.path, ignore_errors=True)
+        current = None
+
+
+def completed(key):
+    """The result fields recorded for an item completed by an earlier run of the job, or None."""
+    if current is None:
+        return None
+    return current.completed.get(str(key))
+
+
+def pending(items, key=None):
+    """Yield the items that earlier runs of the job have not completed. key(item) identifies an item."""
+    for item in items:
+        if completed(item if key is None else key(item)) is None:
+            yield item
+        else:
+            current.skipped += 1
+
+
+def record(key, *fields):
+    """Record in the journal that the item identified by key was completed, with its result fields."""
+    if current is not None:
+        current.record(str(key), list(fields))
+
+
+def _load(job_id):
+    path = jobs_dir() / str(job_id)
+    if not (path / 'job.json').is_file():
+        print(f"Job {job_id} not found", file=sys.stderr)
+        exit(1)
+    return Job(path)
+
+
+def list_jobs():
+    """Print a tab-separated line (ID, status, creation time, completed items, command) for each job."""
+    root = jobs_dir()
+    if not root.is_dir():
+        return
+    for path in sorted((p for p in root.iterdir() if p.name.isdigit()), key=lambda p: int(p.name)):
+        try:
+            job = Job(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        status = job.info['status']
+        if status == 'running' and not job.running():
+            status = 'interrupted'
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job.info['created']))
+        print(f"{job.id}\t{status}\t{created}\t{job.count()}\t{job.info['description']}")
+
+
+def resume(job_id):
+    """Run a job's command again, with the same parameters, skipping the items it has completed."""
+    global _resuming
+    import asp.main
+
+    job = _load(job_id)
+    specs = [spec for spec in asp.main.COMMANDS if spec.get('command') == job.info['command']]
+    if not specs:
+        print(f"Job {job_id} runs an unknown command '{job.info['command']}'", file=sys.stderr)
+        exit(1)
+    if not job.open():
+        print(f"Job {job_id} is still running", file=sys.stderr)
+        exit(1)
+    job.info['status'] = 'running'
+    job._save_info()
+    saved_cwd = os.getcwd()
+    _resuming = job
+    try:
+        os.chdir(job.info['cwd'])
+        asp.main.dispatch(specs[0], dict(job.info['parameters']))
+    finally:
+        if _resuming is not None:  # the command did not get as far as starting the job
+            job.journal.close()
+            _resuming = None
+        os.chdir(saved_cwd)
+
+
+def clear(job_id):
+    """Delete the specified job, or every job that is not running."""
+    paths = [_load(job_id).path] if job_id is not None else [p for p in jobs_dir().glob('*') if p.name.isdigit()]
+    for path in paths:
+        job = Job(path)
+        if job.running():
+            print(f"Job {job.id} is still running", file=sys.stderr)
+            continue
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,105 @@
+import copy
+
+
+class PatchError(Exception):
+    pass
+
+
+def _parse_pointer(pointer):
+    """Split a JSON Pointer (RFC 6901) into its unescaped reference tokens."""
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError(f"Invalid JSON pointer '{pointer}'")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _index(container, token, pointer, allow_end=False):
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token[0] == '0'):
+        raise PatchError(f"Invalid array index '{token}' in '{pointer}'")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"Array index '{token}' out of range in '{pointer}'")
+    return index
+
+
+def _resolve(document, pointer):
+    """Return the parent container of the location named by the pointer, and the last token."""
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        raise PatchError("Operations on the whole document are not supported")
+    parent = document
+    for token in tokens[:-1]:
+        try:
+            parent = parent[_index(parent, token, pointer)] if isinstance(parent, list) else parent[token]
+        except (KeyError, TypeError):
+            raise PatchError(f"Path '{pointer}' does not exist")
+    if not isinstance(parent, (dict, list)):
+        raise PatchError(f"Path '{pointer}' does not exist")
+    return parent, tokens[-1]
+
+
+def _get(document, pointer):
+    if pointer == '':
+        return document
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        return parent[_index(parent, token, pointer)]
+    if token not in parent:
+        raise PatchError(f"Path '{pointer}' does not exist")
+    return parent[token]
+
+
+def _add(document, pointer, value):
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        parent.insert(_index(parent, token, pointer, allow_end=True), value)
+    else:
+        parent[token] = value
+
+
+def _remove(document, pointer):
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, token, pointer))
+    if token not in parent:
+        raise PatchError(f"Path '{pointer}' does not exist")
+    return parent.pop(token)
+
+
+def apply(document, operations):
+    """Apply a list of JSON Patch operations to a document, returning the patched copy.
+
+    The operations are applied atomically: if any of them fails, PatchError is raised and the original document is
+    left untouched.
+    """
+    document = copy.deepcopy(document)
+    for operation in operations:
+        try:
+            op = operation['op']
+            path = operation['path']
+            if op == 'add':
+                _add(document, path, copy.deepcopy(operation['value']))
+            elif op == 'remove':
+                _remove(document, path)
+            elif op == 'replace':
+                _remove(document, path)
+                _add(document, path, copy.deepcopy(operation['value']))
+            elif op == 'move':
+                if path.startswith(operation['from'] + '/'):
+                    raise PatchError(f"Cannot move '{operation['from']}' into one of its children")
+                _add(document, path, _remove(document, operation['from']))
+            elif op == 'copy':
+                _add(document, path, copy.deepcopy(_get(document, operation['from'])))
+            elif op == 'test':
+                if _get(document, path) != operation['value']:
+                    raise PatchError(f"Test failed at '{path}'")
+            else:
+                raise PatchError(f"Invalid operation '{op}'")
+        except KeyError as e:
+            raise PatchError(f"Operation {operation} is missing {e}")
+        except TypeError:
+            raise PatchError(f"Invalid operation {operation}")
+    return document
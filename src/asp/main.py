@@ -1,12 +1,16 @@
+import itertools
 import json
-from typing import Annotated
+import os
+import sys
+from typing import Annotated, Literal
 
 import asp.config as appconfig
-import asp.resources as resources
-import asp.containers as containers
 
 from cyclopts import App, Parameter
 
+# The command modules (and through them, the API client libraries) are imported in dispatch(), when a command that
+# needs them is run, so that '--help' and offline commands start quickly.
+
 config = appconfig.config
 
 
@@ -19,6 +23,9 @@ class Cli(object):
                                                   help="Create, modify, and get info about top containers"))
         self.profile_cmd = self.container_cmd.command(App(name="profile",
                                                           help="Create, modify, and get info about container profiles"))
+        self.index_cmd = self.container_cmd.command(App(name="index",
+                                                        help="Build and query the local index of container barcodes, "
+                                                             "indicators and profiles"))
         self.resource_cmd = self.app.command(App(name="resource",
                                                  help="Create, modify, and get info about resources"))
         self.instance_cmd = self.resource_cmd.command(App(name="instance",
@@ -40,34 +47,107 @@ class Cli(object):
                                                          help="Set or clear default repository"))
         self.cache_token_cmd = self.cache_cmd.command(App(name="token",
                                                           help="Clear the API authentication token"))
+        self.cache_http_cmd = self.cache_cmd.command(App(name="http",
+                                                         help="Clear cached API responses"))
+        self.import_cmd = self.app.command(App(name="import", help="Create many new records at once"))
+        self.snapshot_cmd = self.app.command(App(name="snapshot",
+                                                 help="Back up and restore the records of a repository"))
+        self.search_cmd = self.app.command(App(name="search", help="Find records in the repository"))
+        self.validate_cmd = self.app.command(App(name="validate",
+                                                 help="Check records against the ArchivesSpace schemas"))
+        self.job_cmd = self.app.command(App(name="job",
+                                            help="List, resume or delete interrupted and failed batch jobs"))
+        self.shell_cmd = self.app.command(App(name="shell",
+                                              help="Run many commands, one per line, in a single process"))
+        self.serve_cmd = self.app.command(App(name="serve",
+                                              help="Run commands in a background process that keeps the API session "
+                                                   "open between them"))
 
         self.mapping = {'container': self.container_cmd, 'resource': self.resource_cmd, 'repository': self.repo_cmd,
                         'enumeration': self.enum_cmd, 'enumeration-value': self.enum_value_cmd,
                         'cache': self.cache_cmd, 'resource-instance': self.instance_cmd,
                         'resource-notes': self.notes_cmd, 'container-profile': self.profile_cmd,
+                        'container-index': self.index_cmd,
                         'cache-all': self.cache_all_cmd, 'cache-resource': self.cache_resource_cmd,
-                        'cache-repository': self.cache_repo_cmd, 'cache-token': self.cache_token_cmd}
+                        'cache-repository': self.cache_repo_cmd, 'cache-token': self.cache_token_cmd,
+                        'cache-http': self.cache_http_cmd, 'serve': self.serve_cmd,
+                        'shell': self.shell_cmd, 'import': self.import_cmd, 'job': self.job_cmd,
+                        'validate': self.validate_cmd, 'snapshot': self.snapshot_cmd,
+                        'search': self.search_cmd}
 
 
 def dispatch(spec, parameters):
     """
     Generic caller used by commands.
     """
+    import asp.jobs as jobs
+    with jobs.running(spec, parameters):
+        _dispatch(spec, parameters)
+
+
+def _dispatch(spec, parameters):
     if spec['noun'] == 'cache':
         if spec['verb'] == 'clear':
             if spec['noun2'] == 'all':
-                to_clear = ["resource", "repository", "token"]
+                to_clear = ["resource", "repository", "token", "http"]
             else:
                 to_clear = [spec['noun2']]
+            if "http" in to_clear:
+                config.clear_http_cache()
             config.clear_state(to_clear)
         else:
             config.set_default(spec['noun2'], parameters['id'])
         return
     if spec['command'] == 'container-profile-list':
-        profiles = config.client.get_paged("container_profiles")  # TODO need to make safe wrt 'session_gone'
-        for profile in profiles:
-            print(f'{profile["uri"]}\t{profile["display_string"]}')
+        try:
+            for profile in config.get_paged("container_profiles", cached=spec.get('cached')):
+                print(f'{profile["uri"]}\t{profile["display_string"]}')
+        except appconfig.APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+        return
+    if spec['command'] == 'serve':
+        import asp.daemon as daemon
+        daemon.serve(cli.app, **parameters)
+        return
+    if spec['command'] == 'shell':
+        import asp.shell as shell
+        shell.run(cli.app, **parameters)
+        return
+    if spec['noun'] == 'job':
+        import asp.jobs as jobs
+        if spec['verb'] == 'list':
+            jobs.list_jobs()
+        elif spec['verb'] == 'resume':
+            jobs.resume(parameters['id'])
+        else:
+            jobs.clear(parameters['id'])
+        return
+    if spec['noun'] == 'snapshot':
+        import asp.snapshots as snapshots
+        if spec['verb'] == 'create':
+            snapshots.create(**parameters)
+        elif spec['verb'] == 'restore':
+            snapshots.restore(**parameters)
+        else:
+            snapshots.list_snapshots(**parameters)
+        return
+    if spec['command'] == 'search':
+        import asp.search as search
+        search.search(**parameters)
+        return
+    if spec['command'] == 'validate':
+        import asp.schemas as schemas
+        schemas.validate_file(**parameters)
         return
+    if spec['command'] == 'import-batch':
+        import asp.importer as importer
+        importer.batch_import(**parameters)
+        return
+    if spec['endpoint'] is None and spec['noun'] == 'resource':
+        import asp.resources as resources
+    if spec['endpoint'] is None and spec['noun'] == 'container':
+        import asp.containers as containers
     if spec['command'] == 'resource-notes-add':
         resources.add_notes(**parameters)
         return
@@ -80,6 +160,31 @@ def dispatch(spec, parameters):
     if spec['command'] == 'container-edit':
         containers.edit(**parameters)
         return
+    if spec['command'] == 'container-get' and parameters['id'] is None:
+        if parameters['barcode'] is None:
+            print("No container_id or barcode specified", file=sys.stderr)
+            exit(1)
+        import asp.containers as containers
+        parameters['id'] = containers.resolve_barcode(parameters['barcode'], parameters['repo'])
+    if spec['command'] == 'container-index-build':
+        containers.index_build(**parameters)
+        return
+    if spec['command'] == 'container-index-lookup':
+        for container_id in containers.index_lookup(**parameters):
+            print(container_id)
+        return
+    if spec['command'] == 'container-export':
+        containers.export(**parameters)
+        return
+    if spec['command'] == 'resource-export':
+        resources.export(**parameters)
+        return
+    if spec['command'] == 'resource-patch':
+        resources.patch(**parameters)
+        return
+    if spec['command'] == 'container-edit-batch':
+        containers.edit_batch(**parameters)
+        return
     if spec['command'] == 'enumeration-value-suppress':
         # note that this will allow you to suppress values even if there are items that use this enumeration value
         out_json = appconfig.simple_get("config/enumeration_values/{id}", parameters["id"], None)
@@ -90,6 +195,7 @@ def dispatch(spec, parameters):
         out_json = appconfig.simple_post(None,
                                          f"/config/enumeration_values/{{id}}/suppressed?suppressed={new_state}",
                                          parameters["id"], None)
+        config.clear_http_cache()  # cached enumeration listings are now stale
         print(json.dumps(out_json, indent=2))
     if spec['endpoint'] is not None:
         if 'id' not in parameters:
@@ -97,7 +203,8 @@ def dispatch(spec, parameters):
         if 'repo' not in parameters:
             parameters['repo'] = None
         if spec['method'] == "get":
-            out_json = appconfig.simple_get(spec["endpoint"], parameters["id"], parameters["repo"])
+            out_json = appconfig.simple_get(spec["endpoint"], parameters["id"], parameters["repo"],
+                                            cached=spec.get('cached'))
             if spec['command'] == 'repository-get' and not parameters['verbose']:
                 print(f"{out_json['uri']}\t{out_json['display_string']}")
             elif spec['command'] == 'repository-list':
@@ -113,10 +220,36 @@ def dispatch(spec, parameters):
             else:
                 print(json.dumps(out_json, indent=2))
         if spec['method'] == "post":
-            if 'json' not in parameters:
-                parameters['json_file'] = None
-            out_json = appconfig.simple_post(parameters["json_file"], spec["endpoint"], parameters["id"],
-                                             parameters["repo"])
+            # Records are posted concurrently, each to its own 'uri'. A single record is posted to the endpoint for
+            # the given ID (or the default one, if it has no 'uri'), which its 'uri' must match.
+            import asp.batch as batch
+            import asp.jobs as jobs
+            jobs.begin(stdin=parameters["json_file"] in (None, '-'))
+            records = batch.read_records(parameters["json_file"])
+            first = next(records, None)
+            second = next(records, None)
+            own_uri = first is not None and isinstance(first[1], dict) and first[1].get('uri') is not None
+            if second is not None or (own_uri and parameters["id"] is None):
+                batch.post_records(itertools.chain(filter(None, [first, second]), records), spec["endpoint"],
+                                   parameters["repo"], parameters["workers"], spec["noun"])
+                return
+            jobs.cancel()
+            if first is None:
+                print("No JSON provided", file=sys.stderr)
+                exit(1)
+            if own_uri:
+                target = '/' + spec["endpoint"].format(id=parameters["id"],
+                                                       repo=config.get_default("repository", parameters["repo"]))
+                if first[1]['uri'] != target:
+                    print(f"Record 'uri' {first[1]['uri']!r} does not match {target}", file=sys.stderr)
+                    exit(1)
+            import asp.schemas as schemas
+            try:
+                schemas.check(first[1], spec["noun"])
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                exit(1)
+            out_json = appconfig.simple_post(first[1], spec["endpoint"], parameters["id"], parameters["repo"])
             print(json.dumps(out_json, indent=2))
         return
 
@@ -131,7 +264,10 @@ def register_command(cli, spec):
         # bespoke signatures
         case {'noun': 'resource', 'noun2': 'notes', 'verb': 'add'}:
             @cli_command.command(name=spec["verb"])
-            def _cmd(note_file: str = None, id: int = None, repo: int = None, publish: bool = False):
+            def _cmd(note_file: Annotated[str, Parameter(allow_leading_hyphen=True)] = None, id: int = None,
+                     repo: int = None, publish: bool = False,
+                     ids_file: Annotated[str, Parameter(name="--ids", allow_leading_hyphen=True)] = None,
+                     all: bool = False, workers: int = 4):
                 """Add note(s) resource from information in the provided JSON.
 
                 Parameters
@@ -144,15 +280,22 @@ def register_command(cli, spec):
                     The repository ID number.
                 publish: bool
                     Publish the notes (and sub-notes, if multipart)
+                ids_file: str
+                    Add the notes to each resource whose ID is listed, one per line, in this file ('-' for stdin). A
+                    tab-separated result line (resource ID, number of notes added, status, error) is printed for each.
+                all: bool
+                    Add the notes to every resource in the repository.
+                workers: int
+                    Number of resources to update concurrently.
                 """
                 args = locals()
                 del args['spec']
                 return dispatch(spec, args)
         case {'noun': 'resource', 'noun2': 'instance', 'verb': 'add'}:
             @cli_command.command(name=spec["verb"])
-            def _cmd(object_id: int, container_id: int = None, repo: int = None, itype: str = "mixed_materials",
+            def _cmd(object_id: int = None, container_id: int = None, repo: int = None, itype: str = "mixed_materials",
                      to_resource: bool = False, type2: str = None, indicator2: str = None, barcode2: str = None,
-                     type3: str = None, indicator3: str = None):
+                     type3: str = None, indicator3: str = None, workers: int = 4):
                 """Add a container instance to an archival object or resource.
 
                 Parameters
@@ -160,7 +303,10 @@ def register_command(cli, spec):
                 object_id: int
                     The ID of the archival object (or resource, if '--attach-to-resource') where the instance should be attached.
                 container_id: int
-                    The container ID number. If not provided, read from stdin.
+                    The container ID number. If not provided, lines of 'container_id[,object_id]' are read from stdin
+                    and all of them are attached, with a single update of each object. A tab-separated result line
+                    (object ID, number of instances added, status, error) is printed for each object. Lines without
+                    an object ID are attached to 'object-id'.
                 itype: str
                     The instance type.
                 to_resource: bool
@@ -178,21 +324,25 @@ def register_command(cli, spec):
                     Grandchild instance indicator.
                 repo: int
                     The repository ID number.
+                workers: int
+                    The maximum number of objects to update concurrently when reading from stdin.
                 """
                 args = locals()
                 del args['spec']
                 return dispatch(spec, args)
         case {'noun': 'container', 'noun2': None, 'verb': 'create'}:
             @cli_command.command(name=spec["verb"])
-            def _cmd(indicator: str, ctype: str = None, barcode: str = None, profile: int = None, repo: int = None,
-                     json_out: bool = False):
+            def _cmd(indicator: str = None, ctype: str = None, barcode: str = None, profile: int = None,
+                     repo: int = None, json_out: bool = False,
+                     from_file: Annotated[str, Parameter(name="--from", allow_leading_hyphen=True)] = None,
+                     workers: int = 4):
                 """Create a container. Returns the container identifier of the newly-created container,
                 unless "--json-out" is specified. In that case, the full JSON info is returned.
 
                 Parameters
                 ----------
                 indicator: str
-                    The container indicator.
+                    The container indicator. Required unless '--from' is given.
                 ctype: str
                     The container type.
                 barcode: int
@@ -203,20 +353,27 @@ def register_command(cli, spec):
                     The repository ID number.
                 json_out: bool
                     Output container information as JSON.
+                from_file: str
+                    Create one container per row of this CSV file ('-' for stdin) and print the new identifiers.
+                    The header row must have an 'indicator' column and may have 'ctype', 'barcode' and 'profile'
+                    columns. If there is an 'object_id' column, 'container_id,object_id' is printed for each row,
+                    ready to be piped into 'resource instance add'.
+                workers: int
+                    The maximum number of containers to create concurrently when using '--from'.
                 """
                 args = locals()
                 del args['spec']
                 return dispatch(spec, args)
         case {'noun': 'container', 'noun2': None, 'verb': 'edit'}:
             @cli_command.command(name=spec["verb"])
-            def _cmd(container_id: int, barcode: str = None, ctype: str = None, indicator: str = None,
-                     profile: int = None, repo: int = None):
+            def _cmd(container_id: int = None, barcode: str = None, ctype: str = None, indicator: str = None,
+                     profile: int = None, repo: int = None, find_barcode: str = None):
                 """Edit a container.
 
                 Parameters
                 ----------
                 container_id: int
-                    The container ID number.
+                    The container ID number. Not needed if '--find-barcode' is given.
                 barcode: int
                     The container barcode.
                 ctype: int
@@ -227,12 +384,312 @@ def register_command(cli, spec):
                     The identifier number of the container profile.
                 repo: int
                     The repository ID number.
+                find_barcode: str
+                    Edit the container with this (current) barcode, looked up in the local container index.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'container', 'noun2': None, 'verb': 'get'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(id: int = None, barcode: str = None, repo: int = None):
+                """Get container information.
+
+                Parameters
+                ----------
+                id: int
+                    The container ID number. Not needed if '--barcode' is given.
+                barcode: str
+                    Get the container with this barcode, looked up in the local container index.
+                repo: int
+                    The repository ID number.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'container', 'noun2': 'index', 'verb': 'build'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(repo: int = None, full: bool = False):
+                """Build or refresh the local index used to look up containers by barcode, indicator or profile.
+
+                Parameters
+                ----------
+                repo: int
+                    The repository ID number.
+                full: bool
+                    Rebuild the whole index rather than only fetching containers modified since the last build.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'container', 'noun2': 'index', 'verb': 'lookup'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(barcode: str = None, indicator: str = None, profile: int = None, repo: int = None):
+                """Print the IDs of the containers in the local index matching all the given criteria.
+
+                Parameters
+                ----------
+                barcode: str
+                    The container barcode.
+                indicator: str
+                    The container indicator.
+                profile: int
+                    The identifier number of the container profile.
+                repo: int
+                    The repository ID number.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'container', 'noun2': None, 'verb': 'export'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(repo: int = None, page_size: int = 100, workers: int = 4):
+                """Write every top container in the repository to stdout as NDJSON (one JSON record per line).
+
+                Parameters
+                ----------
+                repo: int
+                    The repository ID number.
+                page_size: int
+                    The number of records fetched per request.
+                workers: int
+                    The maximum number of requests in flight.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'resource', 'noun2': None, 'verb': 'export'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(id: int = None, repo: int = None, all: bool = False, page_size: int = 100, workers: int = 4):
+                """Write the default or specified resource, or all resources in the repository, to stdout as NDJSON
+                (one JSON record per line).
+
+                Parameters
+                ----------
+                id: int
+                    The resource ID number.
+                repo: int
+                    The repository ID number.
+                all: bool
+                    Export every resource in the repository.
+                page_size: int
+                    The number of records fetched per request.
+                workers: int
+                    The maximum number of requests in flight.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'resource', 'noun2': None, 'verb': 'patch'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(id: list[int] = None, ids_file: Annotated[str, Parameter(allow_leading_hyphen=True)] = None,
+                     op: str = None, patch_file: Annotated[str, Parameter(allow_leading_hyphen=True)] = None,
+                     repo: int = None, workers: int = 4):
+                """Edit resources in place with a JSON Patch (RFC 6902). Each resource is fetched, patched and
+                saved once. Prints a tab-separated result line (resource ID, status, error) for each resource.
+
+                Parameters
+                ----------
+                id: list[int]
+                    The resource ID number. May be given more than once. Defaults to the default resource.
+                ids_file: str
+                    File with one resource ID per line, or '-' to read them from stdin.
+                op: str
+                    The JSON Patch: a list of operations, or a single operation, e.g.
+                    '{"op": "replace", "path": "/extents/0/number", "value": "10"}'.
+                patch_file: str
+                    File containing the JSON Patch (a JSON document, or NDJSON with one operation per line), as an
+                    alternative to '--op'. If '-', read from stdin.
+                repo: int
+                    The repository ID number.
+                workers: int
+                    The maximum number of resources to patch concurrently.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'container', 'noun2': None, 'verb': 'edit-batch'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(csv_file: str = None, repo: int = None, workers: int = 4):
+                """Edit many containers from a CSV file in one run. Prints a tab-separated result line
+                (container ID, status, error) for each row.
+
+                Parameters
+                ----------
+                csv_file: str
+                    CSV file with a header row. If not provided or is '-', read from stdin. The 'container_id' column
+                    is required; 'barcode', 'ctype', 'indicator' and 'profile' columns are optional. Empty cells are
+                    left unchanged.
+                repo: int
+                    The repository ID number.
+                workers: int
+                    The maximum number of containers to edit concurrently.
                 """
                 args = locals()
                 del args['spec']
                 return dispatch(spec, args)
 
         # generic signatures
+        case {'noun': 'serve'}:
+            @cli_command.default
+            def _cmd(idle_timeout: float = None, foreground: bool = False, stop: bool = False):
+                """Start a daemon that runs the asp commands given while it is running, saving their startup time.
+
+                Parameters
+                ----------
+                idle_timeout: float
+                    Seconds without commands after which the daemon exits (default: the ASP_SERVE_IDLE_TIMEOUT
+                    setting, or 900). 0 means never.
+                foreground: bool
+                    Run in the foreground instead of detaching.
+                stop: bool
+                    Stop the running daemon.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'import', 'noun2': None, 'verb': 'batch'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(input_file: Annotated[str, Parameter(allow_leading_hyphen=True)] = None, repo: int = None,
+                     csv_input: Annotated[bool, Parameter(name="--csv")] = False, chunk_size: int = 200):
+                """Create top containers and archival objects, and the instances linking them, in a few server-side
+                transactions.
+
+                Parameters
+                ----------
+                input_file: str
+                    NDJSON file with one flat JSON object per line, or CSV file (if its name ends with '.csv') with a
+                    header row. If not provided or is '-', read from stdin. Each row describes a new archival object
+                    (title, level, component_id, resource, parent), a new top container (indicator, ctype, barcode,
+                    profile) or existing one (container_id), or both, with the instance fields (itype, type2,
+                    indicator2, barcode2, type3, indicator3). A tab-separated result line (row, container ID, archival
+                    object ID, status, error) is printed for each row.
+                repo: int
+                    The repository ID number.
+                csv_input: bool
+                    The input is CSV, whatever the file name (e.g. for stdin).
+                chunk_size: int
+                    Number of rows imported per batch_imports request (and transaction).
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'snapshot', 'noun2': None, 'verb': 'create'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(repo: int = None, full: bool = False, page_size: int = 100, workers: int = 4):
+                """Store a compressed copy of every resource, archival object and top container in the repository,
+                and print the ID of the snapshot. Only the records changed since the previous snapshot are fetched.
+
+                Parameters
+                ----------
+                repo: int
+                    The repository ID number.
+                full: bool
+                    Fetch every record, rather than only those changed since the previous snapshot.
+                page_size: int
+                    The number of records fetched per request.
+                workers: int
+                    The maximum number of requests in flight.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'snapshot', 'noun2': None, 'verb': 'restore'}:
+            @cli_command.command(name=spec["verb"])
+            def _cmd(snapshot_id: Annotated[str, Parameter(name="--id")] = None, repo: int = None,
+                     record_type: Annotated[list[Literal["resources", "archival_objects", "top_containers"]],
+                                            Parameter(name="--type")] = None,
+                     dry_run: bool = False, workers: int = 4):
+                """Restore the records changed since a snapshot to their content in the snapshot. Prints a
+                tab-separated result line (record URI, action, status, error) for each record changed since.
+
+                Parameters
+                ----------
+                snapshot_id: str
+                    The snapshot ID. Defaults to the latest snapshot of the repository.
+                repo: int
+                    The repository ID number.
+                record_type: list[str]
+                    Only restore records of this type. May be given more than once.
+                dry_run: bool
+                    Report the records that would be restored, without changing them.
+                workers: int
+                    The maximum number of records to restore concurrently.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'search'}:
+            @cli_command.default
+            def _cmd(q: str = '*', record_type: Annotated[list[str], Parameter(name="--type")] = None,
+                     filters: Annotated[list[str], Parameter(name="--filter")] = None, fields: list[str] = None,
+                     repo: int = None, ndjson: bool = False, page_size: int = 250, workers: int = 2):
+                """Search the repository, and print a tab-separated line with the requested fields (by default the
+                URI, type and title) of each result. Results are streamed page by page, so there is no limit to
+                their number.
+
+                Parameters
+                ----------
+                q: str
+                    The search query, in Solr syntax (e.g. 'title:letters').
+                record_type: list[str]
+                    Only find records of this type (e.g. 'resource', 'archival_object'). May be given more than once.
+                filters: list[str]
+                    Only find records with this value of a field, given as FIELD=VALUE (e.g. 'publish=true'). May be
+                    given more than once.
+                fields: list[str]
+                    The fields to return, one per column, comma-separated or given more than once. The backend only
+                    sends these fields, which is much faster than fetching whole records.
+                repo: int
+                    The repository ID number.
+                ndjson: bool
+                    Print each result as a line of JSON, with the requested fields (or all of them) as properties.
+                page_size: int
+                    The number of results fetched per request (at most the backend's maximum page size).
+                workers: int
+                    The maximum number of pages fetched ahead of the one being printed.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'validate'}:
+            @cli_command.default
+            def _cmd(input_file: Annotated[str, Parameter(allow_leading_hyphen=True)] = None,
+                     jsonmodel_type: Annotated[str, Parameter(name="--type")] = None):
+                """Check JSON or NDJSON records against the schemas of the ArchivesSpace instance, without posting
+                them. The schemas are cached locally, so large files are checked without any round trips.
+
+                Parameters
+                ----------
+                input_file: str
+                    File with a JSON record, or NDJSON with one record per line. If not provided or is '-', read from
+                    stdin. A tab-separated result line (line number, record type, status, problems) is printed for
+                    each record.
+                jsonmodel_type: str
+                    Check the records against the schema of this record type (e.g. 'resource'), rather than the one
+                    named by their 'jsonmodel_type'.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
+        case {'noun': 'shell'}:
+            @cli_command.default
+            def _cmd(script: Annotated[str, Parameter(allow_leading_hyphen=True)] = None,
+                     fail_fast: Annotated[bool, Parameter(negative="--continue")] = False):
+                """Run asp commands, one per line, from a script file, stdin, or an interactive prompt.
+
+                Parameters
+                ----------
+                script: str
+                    File with one asp command per line (the leading 'asp' is optional). If not provided or is '-',
+                    read commands from stdin, prompting for them if stdin is a terminal.
+                fail_fast: bool
+                    Stop at the first command that fails, with its exit status. With '--continue' (the default), run
+                    the remaining commands and exit with the status of the last one that failed.
+                """
+                args = locals()
+                del args['spec']
+                return dispatch(spec, args)
         case {'params': None}:
             @cli_command.command(name=spec["verb"], help=spec["help"])
             def _cmd():
@@ -275,11 +732,15 @@ def register_command(cli, spec):
                 return dispatch(spec, {'id': id, 'repo': repo})
         case {'params': 'json_id-o_repo-o'}:
             @cli_command.command(name=spec["verb"], help=spec["help"])
-            def _cmd(json_file: Annotated[str,
-                            Parameter(help="Filename of the JSON payload file or '-' to read from 'stdin'")] = None,
+            def _cmd(json_file: Annotated[str, Parameter(
+                         help="Filename of the JSON payload file or '-' to read from 'stdin'. "
+                              "NDJSON input with several records posts each record to its own 'uri'.",
+                         allow_leading_hyphen=True)] = None,
                      id: Annotated[int, Parameter(help=f"The ID of the {thingy}")] = None,
-                     repo: Annotated[int, Parameter(help="The repository ID")] = None):
-                return dispatch(spec, {'json_file': json_file, 'id': id, 'repo': repo})
+                     repo: Annotated[int, Parameter(help="The repository ID")] = None,
+                     workers: Annotated[int, Parameter(help="The maximum number of records posted concurrently "
+                                                            "from NDJSON input")] = 4):
+                return dispatch(spec, {'json_file': json_file, 'id': id, 'repo': repo, 'workers': workers})
 
 
 COMMANDS = [
@@ -295,14 +756,20 @@ COMMANDS = [
     {"noun": "resource", "noun2": None, "verb": "update",
      "params": "json_id-o_repo-o", "endpoint": "repositories/{repo}/resources/{id}", "method": "post", "output": None,
      "help": "Update resource from provided JSON."},
+    {"noun": "resource", "noun2": None, "verb": "export",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Export resources as NDJSON."},
+    {"noun": "resource", "noun2": None, "verb": "patch",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Edit resources in place with a JSON Patch."},
     {"noun": "repository", "noun2": None, "verb": "get",
-     "params": "id-o_v", "endpoint": "repositories/{repo}", "method": "get", "output": None,
+     "params": "id-o_v", "endpoint": "repositories/{repo}", "method": "get", "output": None, "cached": True,
      "help": "Get information about the default or specified repository."},
     {"noun": "repository", "noun2": None, "verb": "list",
-     "params": None, "endpoint": "repositories", "method": "get", "output": None,
+     "params": None, "endpoint": "repositories", "method": "get", "output": None, "cached": True,
      "help": "List all repositories."},
     {"noun": "enumeration", "noun2": None, "verb": "get",
-     "params": "id_v", "endpoint": "config/enumerations/{id}", "method": "get", "output": None,
+     "params": "id_v", "endpoint": "config/enumerations/{id}", "method": "get", "output": None, "cached": True,
      "help": "Get values in an enumeration list"},
     {"noun": "enumeration", "noun2": "value", "verb": "suppress",
      "params": "id", "endpoint": None, "method": None, "output": None,
@@ -314,12 +781,57 @@ COMMANDS = [
     {"noun": "container", "noun2": None, "verb": "edit",
      "params": "cont_edit", "endpoint": None, "method": None, "output": None,
      "help": "Edit a container."},
+    {"noun": "container", "noun2": None, "verb": "edit-batch",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Edit many containers from a CSV file."},
     {"noun": "container", "noun2": None, "verb": "get",
-     "params": "id_repo-o", "endpoint": "repositories/{repo}/top_containers/{id}", "method": "get", "output": None,
+     "params": "cont_get", "endpoint": "repositories/{repo}/top_containers/{id}", "method": "get", "output": None,
      "help": "Get container information."},
-    {"noun": "container", "noun2": "profile", "verb": "list",
+    {"noun": "container", "noun2": None, "verb": "export",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Export all top containers as NDJSON."},
+    {"noun": "container", "noun2": "index", "verb": "build",
      "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Build or refresh the local container index."},
+    {"noun": "container", "noun2": "index", "verb": "lookup",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Look up container IDs in the local container index."},
+    {"noun": "container", "noun2": "profile", "verb": "list",
+     "params": None, "endpoint": None, "method": None, "output": None, "cached": True,
      "help": "List all container profiles."},
+    {"noun": "import", "noun2": None, "verb": "batch",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Create top containers and archival objects in a few server-side transactions."},
+    {"noun": "snapshot", "noun2": None, "verb": "create",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Store a copy of the records of a repository."},
+    {"noun": "snapshot", "noun2": None, "verb": "restore",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Restore the records changed since a snapshot."},
+    {"noun": "snapshot", "noun2": None, "verb": "list",
+     "params": "repo-o", "endpoint": None, "method": None, "output": None,
+     "help": "List the snapshots of the repository: ID, creation time and number of records of each type."},
+    {"noun": "search", "noun2": None, "verb": None,
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Find records in the repository."},
+    {"noun": "validate", "noun2": None, "verb": None,
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Check records against the ArchivesSpace schemas."},
+    {"noun": "job", "noun2": None, "verb": "list",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "List the batch jobs that can be resumed: ID, status, creation time, completed items and command."},
+    {"noun": "job", "noun2": None, "verb": "resume",
+     "params": "id", "endpoint": None, "method": None, "output": None,
+     "help": "Run a batch job again, skipping the items it has completed."},
+    {"noun": "job", "noun2": None, "verb": "clear",
+     "params": "id-o", "endpoint": None, "method": None, "output": None,
+     "help": "Delete the specified batch job, or all of them."},
+    {"noun": "shell", "noun2": None, "verb": None,
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Run many commands, one per line, in a single process."},
+    {"noun": "serve", "noun2": None, "verb": None,
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Start a daemon that runs asp commands without their startup time."},
     {"noun": "cache", "noun2": "all", "verb": "clear",
      "params": None, "endpoint": None, "method": None, "output": None,
      "help": "Clear all cached tokens and defaults."},
@@ -335,6 +847,9 @@ COMMANDS = [
     {"noun": "cache", "noun2": "resource", "verb": "clear",
      "params": None, "endpoint": None, "method": None, "output": None,
      "help": "Clear the default resource ID."},
+    {"noun": "cache", "noun2": "http", "verb": "clear",
+     "params": None, "endpoint": None, "method": None, "output": None,
+     "help": "Clear cached responses of slow-changing API data (repositories, enumerations, container profiles)."},
     {"noun": "cache", "noun2": "token", "verb": "clear",
      "params": None, "endpoint": None, "method": None, "output": None,
      "help": "Clear the ArchivesSpace authentication token."}
@@ -347,7 +862,13 @@ for spec in COMMANDS:
 
 
 def main():
-    cli.app()
+    try:
+        cli.app()
+    except BrokenPipeError:
+        # The reader of our output went away early (e.g. 'asp container export | head'). Point stdout at devnull so
+        # that flushing it at exit doesn't raise again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
 
 
 if __name__ == "__main__":
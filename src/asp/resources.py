@@ -1,8 +1,14 @@
 import copy
+import itertools
 import json
 import sys
 
+import asp.aio as aio
+import asp.batch as batch
 import asp.config as appconfig
+import asp.jobs as jobs
+import asp.jsonpatch as jsonpatch
+import asp.schemas as schemas
 
 config = appconfig.config
 
@@ -14,7 +20,8 @@ note_multipart_template = {"jsonmodel_type": "note_multipart", "label": None, "t
                            "publish": False}
 
 
-def add_notes(note_file, id, repo, publish):
+def build_notes(note_file, publish):
+    """Build the ArchivesSpace note JSON for each note definition in the provided JSON file (or stdin)."""
     if note_file is None or note_file == '-':
         input_json = json.load(sys.stdin)
     else:
@@ -29,12 +36,7 @@ def add_notes(note_file, id, repo, publish):
             print("Error decoding JSON from file. File might be corrupted.", file=sys.stderr)
             exit(1)
 
-    repo = config.get_default("repository", repo)
-    id = config.get_default("resource", id)
-
-    resource = config.safe_get(f'repositories/{repo}/resources/{id}')
-    resource_json = json.loads(resource.text)
-
+    notes = []
     for note_info in input_json:
         if "jsonmodel_type" not in note_info:
             print("jsonmodel_type cannot be empty", file=sys.stderr)
@@ -61,15 +63,149 @@ def add_notes(note_file, id, repo, publish):
             note_json["label"] = note_info["label"]
         else:
             del note_json["label"]
+        notes.append(note_json)
+    return notes
 
-        if 'notes' in resource_json:
-            resource_json["notes"].append(note_json)
-        else:
-            resource_json["notes"] = [note_json]
 
-    out = config.safe_post(f'repositories/{repo}/resources/{id}', json=resource_json)
-    out_json = json.loads(out.text)
-    print(json.dumps(out_json, indent=2))
+def _note_key(note):
+    """The parts of a note that identify its content, ignoring the fields the server adds (persistent_id etc.)."""
+    def content(value):
+        return tuple(value) if isinstance(value, list) else (value,)
+    subnotes = tuple(content(subnote.get("content")) for subnote in note.get("subnotes", []))
+    return (note.get("jsonmodel_type"), note.get("type"), note.get("label"), content(note.get("content")), subnotes)
+
+
+def append_notes(record, notes):
+    """Append the notes that the record does not already have, and return the number appended."""
+    existing = {_note_key(note) for note in record.get("notes", [])}
+    new = [note for note in notes if _note_key(note) not in existing]
+    record.setdefault("notes", []).extend(copy.deepcopy(new))
+    return len(new)
+
+
+def add_notes(note_file, id, repo, publish, ids_file, all, workers):
+    """Add the notes to the specified resource, or to each of many resources.
+
+    The note definitions are read and validated once. Notes which a resource already has are not added again, so
+    re-running the command is harmless. For many resources, they are updated concurrently, and a tab-separated result
+    line (resource identifier, number of notes added, status, error) is printed for each.
+    """
+    if ids_file is not None and all:
+        print("Specify at most one of '--ids' and '--all'", file=sys.stderr)
+        exit(1)
+    if ids_file == '-' and note_file in (None, '-'):
+        print("The note JSON and the resource IDs cannot both be read from stdin", file=sys.stderr)
+        exit(1)
+    if ids_file is not None or all:
+        jobs.begin(stdin=note_file in (None, '-') or ids_file == '-')
+    notes = build_notes(note_file, publish)
+    try:
+        for note in notes:
+            schemas.check(note)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    repo = config.get_default("repository", repo)
+
+    if ids_file is None and not all:
+        id = config.get_default("resource", id)
+        _, out_json = config.safe_update(f'repositories/{repo}/resources/{id}',
+                                         lambda record: append_notes(record, notes))
+        if out_json is None:
+            print("The resource already has these notes", file=sys.stderr)
+            return
+        print(json.dumps(out_json, indent=2))
+        return
+
+    if all:
+        try:
+            ids = config.request('get', f'repositories/{repo}/resources', params={'all_ids': True}).json()
+        except appconfig.APIError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+    else:
+        ids = batch.read_ids(ids_file)
+
+    async def add_one(api, resource_id):
+        added, _ = await api.update(f'repositories/{repo}/resources/{resource_id}',
+                                    lambda record: append_notes(record, notes))
+        return added
+
+    failed = False
+    for resource_id, added, error in aio.run(add_one, jobs.pending(ids), workers):
+        batch.report(resource_id, added, error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
+
+
+def export(id, repo, all, page_size, workers):
+    """Stream the specified resource, or every resource in the repository, to stdout as NDJSON."""
+    repo = config.get_default("repository", repo)
+    ids = None if all else [config.get_default("resource", id)]
+    try:
+        for record in aio.get_all(f'repositories/{repo}/resources', ids=ids, page_size=page_size, workers=workers):
+            batch.print_ndjson(record)
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+
+
+def patch(id, ids_file, op, patch_file, repo, workers):
+    """Apply a JSON Patch (RFC 6902) to one or more resources.
+
+    Each resource is fetched once, patched in memory and posted back once. Resources are patched concurrently, and a
+    tab-separated result line (resource identifier, status, error) is printed for each.
+    """
+    if (op is None) == (patch_file is None):
+        print("Specify exactly one of '--op' and '--patch-file'", file=sys.stderr)
+        exit(1)
+    if ids_file == '-' and op is None and patch_file in (None, '-'):
+        print("The JSON patch and the resource IDs cannot both be read from stdin", file=sys.stderr)
+        exit(1)
+    if ids_file is not None:
+        jobs.begin(stdin=ids_file == '-' or op is None and patch_file in (None, '-'))
+    if op is not None:
+        try:
+            operations = json.loads(op)
+        except json.JSONDecodeError:
+            print("Error decoding the JSON patch", file=sys.stderr)
+            exit(1)
+    else:
+        # A JSON document, or NDJSON with one operation (or list of operations) per line
+        operations = []
+        for line, record, error in batch.read_records(patch_file):
+            if error is not None:
+                print(f"Error decoding the JSON patch on line {line}", file=sys.stderr)
+                exit(1)
+            operations.extend(record if isinstance(record, list) else [record])
+    if isinstance(operations, dict):
+        operations = [operations]
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        print("The JSON patch must be an operation (a JSON object) or a list of operations", file=sys.stderr)
+        exit(1)
+
+    repo = config.get_default("repository", repo)
+    if ids_file is not None:
+        ids = itertools.chain(id or [], batch.read_ids(ids_file))
+    else:
+        ids = id or [config.get_default("resource", None)]
+
+    def apply_patch(record):
+        patched = jsonpatch.apply(record, operations)
+        schemas.check(patched)
+        record.clear()
+        record.update(patched)
+
+    async def patch_one(api, resource_id):
+        await api.update(f'repositories/{repo}/resources/{resource_id}', apply_patch)
+
+    failed = False
+    for resource_id, _, error in aio.run(patch_one, jobs.pending(ids), workers):
+        batch.report(resource_id, error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
 
 
 instance_template = {
@@ -86,46 +222,109 @@ instance_template = {
 
 
 def add_instance(container_id, object_id, repo, itype, to_resource, type2, indicator2, barcode2,
-                 type3, indicator3):
+                 type3, indicator3, workers):
     """Add an instance to an Archival Object or Resource.
 
        CONTAINER_ID is the container identifier to be added and OBJECT_ID is the identifier of the Archival Object
        to which the instance should be added, unless the 'attach_to_resource' is True. In that case, the instance
        will be added to the top level of the resource with identifier OBJECT_ID.
+
+       If CONTAINER_ID is not given, lines of the form 'container_id[,object_id]' are read from stdin and every
+       container is attached in the same run, with one read and one write per object. Lines without an object
+       identifier use OBJECT_ID.
     """
     repo = config.get_default("repository", repo)
+    if to_resource:
+        endpoint = "resources"
+    else:
+        endpoint = "archival_objects"
+
+    def make_instance(cid):
+        return instance_json(repo, cid, itype, type2, indicator2, barcode2, type3, indicator3)
+
     if container_id is None:
-        container_id = int(sys.stdin.readline().rstrip("\n"))
+        jobs.begin(stdin=True)
+        add_instance_stream(sys.stdin, object_id, repo, endpoint, make_instance, workers)
+        return
+    if object_id is None:
+        print("No object_id specified", file=sys.stderr)
+        exit(1)
+
+    _, out_json = config.safe_update(f'repositories/{repo}/{endpoint}/{object_id}',
+                                     lambda record: append_instances(record, [make_instance(container_id)]))
+    print(json.dumps(out_json, indent=2))
 
-    instance_json = copy.deepcopy(instance_template)
-    instance_json['sub_container']['top_container']['ref'] = f"/repositories/{repo}/top_containers/{container_id}"
-    instance_json['instance_type'] = itype
+
+def instance_json(repo, container_id, itype, type2, indicator2, barcode2, type3, indicator3):
+    new_instance = copy.deepcopy(instance_template)
+    new_instance['sub_container']['top_container']['ref'] = f"/repositories/{repo}/top_containers/{container_id}"
+    new_instance['instance_type'] = itype
     if type2:
-        instance_json['sub_container']['type_2'] = type2
+        new_instance['sub_container']['type_2'] = type2
     if indicator2:
-        instance_json['sub_container']['indicator_2'] = indicator2
+        new_instance['sub_container']['indicator_2'] = indicator2
     if barcode2:
-        instance_json['sub_container']['barcode_2'] = barcode2
+        new_instance['sub_container']['barcode_2'] = barcode2
     if type3:
-        instance_json['sub_container']['type_3'] = type3
+        new_instance['sub_container']['type_3'] = type3
     if indicator3:
-        instance_json['sub_container']['indicator_3'] = indicator3
+        new_instance['sub_container']['indicator_3'] = indicator3
+    return new_instance
 
-    if to_resource:
-        endpoint = "resources"
-    else:
-        endpoint = "archival_objects"
 
-    out = config.safe_get(f'repositories/{repo}/{endpoint}/{object_id}')
-    out_json = json.loads(out.text)
-    if out_json.get('instances') and type(out_json['instances']) is list:
-        out_json['instances'].append(instance_json)
+def append_instances(record_json, instances):
+    if record_json.get('instances') and type(record_json['instances']) is list:
+        record_json['instances'].extend(instances)
     else:
-        out_json['instances'] = [instance_json]
+        record_json['instances'] = list(instances)
 
-    out = config.safe_post(f'/repositories/{repo}/{endpoint}/{object_id}', json=out_json)
-    out_json = json.loads(out.text)
-    print(json.dumps(out_json, indent=2))
+
+def read_pairs(stream, default_object_id):
+    """Parse 'container_id[,object_id]' lines, yielding (container_id, object_id, error) tuples."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        fields = [f.strip() for f in line.split(',')]
+        container_id = fields[0]
+        object_id = fields[1] if len(fields) > 1 and fields[1] else default_object_id
+        if not container_id.isdigit():
+            yield container_id, object_id, ValueError(f"Invalid container_id '{container_id}'")
+        elif object_id is None:
+            yield container_id, object_id, ValueError("No object_id specified")
+        elif not str(object_id).isdigit():
+            yield container_id, object_id, ValueError(f"Invalid object_id '{object_id}'")
+        else:
+            yield int(container_id), int(object_id), None
+
+
+def add_instance_stream(stream, default_object_id, repo, endpoint, make_instance, workers):
+    """Attach a stream of containers to their objects over one session.
+
+    Instances are grouped by target object, so that each object is fetched and saved once no matter how many
+    containers are attached to it. Objects are updated concurrently, and a result line (object identifier, number of
+    instances added, status, error) is printed for each object.
+    """
+    failed = False
+    groups = {}
+    for container_id, object_id, error in read_pairs(stream, default_object_id):
+        if error is not None:
+            batch.report(object_id, 0, error=ValueError(f"Container {container_id}: {error}"))
+            failed = True
+        else:
+            groups.setdefault(object_id, []).append(container_id)
+
+    async def attach(api, item):
+        object_id, container_ids = item
+        await api.update(f'repositories/{repo}/{endpoint}/{object_id}',
+                         lambda record: append_instances(record, [make_instance(cid) for cid in container_ids]))
+
+    items = jobs.pending(groups.items(), key=lambda item: item[0])
+    for (object_id, container_ids), _, error in aio.run(attach, items, workers):
+        batch.report(object_id, len(container_ids), error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import sys
+import time
+
+import asp.config as appconfig
+
+config = appconfig.config
+
+# The JSON schemas of the backend ('/schemas') are cached on disk, tagged with the backend's base URL and version
+# ('/version'), so that records can be checked before they are posted without fetching the schemas every time. The
+# version is checked again every ASP_HTTP_CACHE_TTL seconds, and the schemas are refetched when it changes.
+#
+# ArchivesSpace schemas are draft-03 JSON Schema with JSONModel extensions: 'ifmissing' marks required properties,
+# types can be 'JSONModel(:type) object' (a nested record) or 'JSONModel(:type) uri' (a reference), and a type can
+# be a list of alternatives. Only what can be checked without the database is validated: required properties, types,
+# lengths, patterns, static enums and ranges. Dynamic enums and references are left to the backend.
+
+JSONMODEL_TYPE = re.compile(r'JSONModel\(:(\w+)\) (object|uri|uri_or_object)')
+
+_cache = None  # the loaded cache file, shared by the commands run by a daemon or shell
+_unavailable = None  # when the schemas last could not be fetched
+
+
+def _cache_path():
+    return config.http_cache_dir / 'schemas.json'
+
+
+def _fetch(baseurl, version):
+    global _cache
+    out = config.request('get', 'schemas')
+    _cache = {'baseurl': baseurl, 'version': version, 'checked': time.time(), 'schemas': out.json()}
+    config.http_cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = _cache_path().with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(_cache, f)
+        os.replace(tmp_path, _cache_path())
+    except OSError as e:
+        print(f"Error saving the schema cache: {e}", file=sys.stderr)
+
+
+def load():
+    """Return the backend's schemas by record type, from the cache if the backend's version hasn't changed.
+
+    Raises APIError if they had to be fetched and could not be.
+    """
+    global _cache
+    baseurl = config.asnake_config['baseurl']
+    if _cache is None:
+        try:
+            with open(_cache_path(), 'r') as f:
+                _cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _cache = None
+    if _cache is not None and _cache['baseurl'] != baseurl:
+        _cache = None
+    if _cache is not None and time.time() - _cache['checked'] < config.setting('http_cache_ttl', 3600.0, float):
+        return _cache['schemas']
+
+    try:
+        version = config.request('get', 'version').text.strip()
+    except appconfig.APIError:
+        if _cache is not None:
+            return _cache['schemas']  # offline: the cached schemas are better than none
+        raise
+    if _cache is not None and _cache['version'] == version:
+        _cache['checked'] = time.time()
+    else:
+        _fetch(baseurl, version)
+    return _cache['schemas']
+
+
+def _schema(schemas, name):
+    """The schema of a record type, with the properties it inherits from its parent type."""
+    schema = schemas.get(name)
+    if schema is None or 'parent' not in schema:
+        return schema
+    parent = _schema(schemas, schema['parent']) or {}
+    return dict(schema, properties={**parent.get('properties', {}), **schema.get('properties', {})})
+
+
+def _jsonmodel_name(type_):
+    """The record type of a 'JSONModel(:type) ...' type, plain or wrapped in a schema, or None."""
+    match = JSONMODEL_TYPE.fullmatch((type_.get('type') if isinstance(type_, dict) else type_) or '')
+    return match[1] if match is not None else None
+
+
+def _matches(pattern, value):
+    """Whether a value matches a schema pattern. The patterns are Ruby regular expressions, which mostly work in Python
+    once Ruby's end of string anchor is translated; any other pattern that doesn't compile is not checked."""
+    try:
+        return re.search(pattern.replace('\\z', '\\Z'), value) is not None
+    except re.error:
+        return True
+
+
+def _type_errors(value, type_, path, schemas):
+    """The errors of a value checked against one type: a name, a JSONModel type or a schema."""
+    if isinstance(type_, dict):
+        return _errors(value, type_, path, schemas)
+    match = JSONMODEL_TYPE.fullmatch(type_)
+    if match is not None:
+        name, kind = match.groups()
+        if kind != 'object' and isinstance(value, str):
+            return [] if value.startswith('/') else [f"{path}: '{value}' is not a {name} URI"]
+        if kind != 'uri' and isinstance(value, dict):
+            schema = _schema(schemas, name)
+            return _record_errors(value, schema, name, path, schemas) if schema else []
+        return [f"{path}: expected a {name} {'record' if kind == 'object' else 'URI'}"]
+    checks = {'string': lambda v: isinstance(v, str),
+              'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+              'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+              'boolean': lambda v: isinstance(v, bool),
+              'object': lambda v: isinstance(v, dict),
+              'array': lambda v: isinstance(v, list),
+              'null': lambda v: v is None}
+    if type_ in checks and not checks[type_](value):
+        return [f"{path}: expected {type_}, got {json.dumps(value)[:40]}"]
+    return []
+
+
+def _errors(value, schema, path, schemas):
+    """The errors of a value checked against a (property) schema."""
+    type_ = schema.get('type', 'any')
+    if isinstance(type_, list):
+        alternatives = type_
+        if isinstance(value, dict) and 'jsonmodel_type' in value:
+            # A list of record types (e.g. the kinds of note): check against the one the record says it is
+            alternatives = [t for t in type_ if _jsonmodel_name(t) == value['jsonmodel_type']] or type_
+        results = [_type_errors(value, t, path, schemas) for t in alternatives]
+        if not any(not errors for errors in results):
+            return results[0] if len(results) == 1 else [f"{path}: does not match any of the allowed types"]
+        errors = []
+    else:
+        errors = _type_errors(value, type_, path, schemas)
+        if errors:
+            return errors
+
+    if isinstance(value, str):
+        if 'minLength' in schema and len(value) < schema['minLength']:
+            errors.append(f"{path}: must be at least {schema['minLength']} characters long")
+        if 'maxLength' in schema and len(value) > schema['maxLength']:
+            errors.append(f"{path}: must be at most {schema['maxLength']} characters long")
+        if 'pattern' in schema and not _matches(schema['pattern'], value):
+            errors.append(f"{path}: does not match '{schema['pattern']}'")
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: must be one of {', '.join(map(str, schema['enum']))}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if 'minimum' in schema and value < schema['minimum']:
+            errors.append(f"{path}: must be at least {schema['minimum']}")
+        if 'maximum' in schema and value > schema['maximum']:
+            errors.append(f"{path}: must be at most {schema['maximum']}")
+    if isinstance(value, list):
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append(f"{path}: must have at least {schema['minItems']} item(s)")
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append(f"{path}: must have at most {schema['maxItems']} item(s)")
+        if isinstance(schema.get('items'), dict):
+            for i, item in enumerate(value):
+                errors.extend(_errors(item, schema['items'], f"{path}/{i}", schemas))
+    if isinstance(value, dict) and 'properties' in schema:
+        errors.extend(_properties_errors(value, schema['properties'], path, schemas))
+    return errors
+
+
+def _properties_errors(record, properties, path, schemas):
+    errors = []
+    for name, schema in properties.items():
+        if schema.get('readonly'):
+            continue
+        value = record.get(name)
+        if value in (None, '', []) and (schema.get('ifmissing') == 'error' or schema.get('required') is True):
+            errors.append(f"{path}/{name}: is required")
+            continue
+        if value is None:
+            continue
+        errors.extend(_errors(value, schema, f"{path}/{name}", schemas))
+    return errors
+
+
+def _record_errors(record, schema, name, path, schemas):
+    if record.get('jsonmodel_type', name) != name:
+        return [f"{path}/jsonmodel_type: expected '{name}', got '{record['jsonmodel_type']}'"]
+    return _properties_errors(record, schema.get('properties', {}), path, schemas)
+
+
+def validate(record, jsonmodel_type=None, schemas=None):
+    """Return the list of problems with a record, checked against the schema of its type (or of its jsonmodel_type)."""
+    if not isinstance(record, dict):
+        return ["expected a JSON object"]
+    if schemas is None:
+        schemas = load()
+    jsonmodel_type = jsonmodel_type or record.get('jsonmodel_type')
+    if jsonmodel_type is None:
+        return ["jsonmodel_type: is required"]
+    schema = _schema(schemas, jsonmodel_type)
+    if schema is None:
+        return [f"jsonmodel_type: unknown record type '{jsonmodel_type}'"]
+    return _record_errors(record, schema, jsonmodel_type, '', schemas)
+
+
+def check(record, jsonmodel_type=None):
+    """Raise ValueError if the record is invalid, so that it isn't posted.
+
+    Does nothing if the ASP_VALIDATE setting is off, or if the schemas are not available (with a warning).
+    """
+    global _unavailable
+    if not config.setting('validate', True, appconfig.to_bool):
+        return
+    if _unavailable is not None and time.time() - _unavailable < config.setting('http_cache_ttl', 3600.0, float):
+        return
+    try:
+        schemas = load()
+    except appconfig.APIError as e:
+        print(f"Records are not validated, since the schemas could not be fetched: {e}", file=sys.stderr)
+        _unavailable = time.time()
+        return
+    errors = validate(record, jsonmodel_type, schemas)
+    if errors:
+        raise ValueError('Invalid record: ' + '; '.join(errors))
+
+
+def validate_file(input_file, jsonmodel_type):
+    """Check every record of a JSON or NDJSON file (or stdin) against the backend's schemas, without posting anything.
+
+    A tab-separated result line (line number, record type, status, problems) is printed for each record.
+    """
+    import asp.batch as batch
+
+    try:
+        schemas = load()
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    failed = 0
+    for line, record, error in batch.read_records(input_file):
+        record_type = jsonmodel_type or (record.get('jsonmodel_type') if isinstance(record, dict) else None)
+        if error is None:
+            errors = validate(record, record_type, schemas)
+            error = ValueError('; '.join(errors)) if errors else None
+        batch.report(line, record_type, error=error)
+        failed += error is not None
+    if failed:
+        print(f"{failed} invalid record(s)", file=sys.stderr)
+        sys.exit(1)
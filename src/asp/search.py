@@ -0,0 +1,79 @@
+import json
+import sys
+
+import asp.aio as aio
+import asp.batch as batch
+import asp.config as appconfig
+
+config = appconfig.config
+
+# Columns printed when no fields are requested
+DEFAULT_FIELDS = ('uri', 'primary_type', 'title')
+
+
+def _params(q, record_type, filters, fields, page_size):
+    """The search parameters. Both API clients add the '[]' suffix to the names of the array-valued ones."""
+    params = {'q': q, 'page_size': page_size}
+    if record_type:
+        params['type'] = record_type
+    if fields:
+        params['fields'] = fields
+    filter_terms = []
+    for term in filters or []:
+        field, sep, value = term.partition('=')
+        if not sep or not field:
+            raise ValueError(f"Invalid filter '{term}': expected FIELD=VALUE")
+        filter_terms.append(json.dumps({field: value}))
+    if filter_terms:
+        params['filter_term'] = filter_terms
+    return params
+
+
+def _tsv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return '|'.join(_tsv_value(v) for v in value)
+    return ' '.join(str(value).split())
+
+
+def results(repo, params, workers):
+    """Yield the results of a search, a page at a time. The first page gives the number of pages; the following ones
+    are fetched ahead of the one being consumed, at most `workers` at once, so memory use doesn't grow with the number
+    of results."""
+    endpoint = f'repositories/{repo}/search'
+    first = config.request('get', endpoint, params=dict(params, page=1)).json()
+    yield from first['results']
+
+    async def fetch(api, page):
+        return await api.get_json(endpoint, params=dict(params, page=page))
+
+    for _, page_json, error in aio.run(fetch, range(2, first['last_page'] + 1), workers):
+        if error is not None:
+            raise error
+        yield from page_json['results']
+
+
+def search(q, record_type, filters, fields, repo, ndjson, page_size, workers):
+    """Search the repository and stream the results to stdout, as tab-separated lines with the requested fields (or
+    the URI, type and title of each result), or as NDJSON.
+
+    Only the requested fields are returned by the backend, which is much cheaper than fetching whole records.
+    """
+    repo = config.get_default("repository", repo)
+    fields = [field.strip() for value in fields or [] for field in value.split(',') if field.strip()]
+    try:
+        params = _params(q, record_type, filters, fields or (None if ndjson else list(DEFAULT_FIELDS)), page_size)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    columns = fields or DEFAULT_FIELDS
+    try:
+        for result in results(repo, params, workers):
+            if ndjson:
+                batch.print_ndjson(result)
+            else:
+                print('\t'.join(_tsv_value(result.get(column)) for column in columns))
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
@@ -0,0 +1,107 @@
+import io
+import shlex
+import sys
+import time
+
+import asp.config as appconfig
+import asp.daemon as daemon
+
+config = appconfig.config
+
+
+class _SharedInput(io.TextIOBase):
+    """The shell's stdin, as given to a command. Commands that fail call exit(), which closes sys.stdin: this stand-in
+    stays open, so that the shell can still read its next command (or the commands their input) afterwards."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        pass
+
+
+def _lines(script):
+    """Yield (line number, line) from the script file, stdin, or an interactive prompt if stdin is a terminal."""
+    if script is None and sys.stdin.isatty():
+        try:
+            import readline  # noqa: F401 (line editing and history for input())
+        except ImportError:
+            pass
+        line_number = 0
+        while True:
+            try:
+                line = input('asp> ')
+            except EOFError:
+                print(file=sys.stderr)
+                return
+            line_number += 1
+            yield line_number, line
+    elif script is None or script == '-':
+        yield from enumerate(sys.stdin, start=1)
+    else:
+        try:
+            f = open(script, 'r')
+        except FileNotFoundError:
+            print(f"Script file '{script}' not found", file=sys.stderr)
+            exit(1)
+        with f:
+            yield from enumerate(f, start=1)
+
+
+def run(app, script, fail_fast):
+    """Run asp commands, one per line, in this process, so that startup and authentication are paid for only once.
+
+    Blank lines and comments are skipped, and a leading 'asp' is ignored, so that lines can be copied from shell
+    scripts. The exit status and duration of each command are printed to stderr. If the script is read from stdin, the
+    commands themselves get an empty stdin.
+    """
+    from_stdin = (script is None or script == '-') and not sys.stdin.isatty()
+    failed = 0
+    for line_number, line in _lines(script):
+        try:
+            tokens = shlex.split(line, comments=True)
+        except ValueError as e:
+            print(f"Line {line_number}: {e}", file=sys.stderr)
+            code = 1
+            tokens = None
+        if tokens is not None:
+            if tokens[:1] == ['asp']:
+                tokens = tokens[1:]
+            if not tokens:
+                continue
+            if tokens[0] in ('shell', 'serve'):
+                print(f"Line {line_number}: 'asp {tokens[0]}' cannot be run from 'asp shell'", file=sys.stderr)
+                code = 1
+            else:
+                stdin = sys.stdin
+                sys.stdin = io.StringIO() if from_stdin else _SharedInput(stdin)
+                start = time.perf_counter()
+                try:
+                    code = daemon.run_command(app, tokens)
+                finally:
+                    sys.stdin = stdin
+                elapsed = time.perf_counter() - start
+                sys.stdout.flush()
+                config.save_state()
+                print(f"[{line_number}] exit {code} in {elapsed:.3f} s: {' '.join(tokens)}", file=sys.stderr)
+        if code != 0:
+            failed = code
+            if fail_fast:
+                break
+    if failed:
+        sys.exit(failed)
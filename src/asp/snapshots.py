@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import asp.aio as aio
+import asp.batch as batch
+import asp.config as appconfig
+import asp.jobs as jobs
+
+config = appconfig.config
+
+# A snapshot is a gzipped manifest in 'snapshots/<repository>/' in the data dir, listing for each record type the ID
+# and content hash of every record. The records themselves are stored once per distinct content, gzipped, in
+# 'snapshots/objects/', so consecutive snapshots share the records that did not change. A new snapshot only fetches the
+# records created or modified (according to 'modified_since') since the newest 'system_mtime' of the previous one.
+
+RECORD_TYPES = ('resources', 'archival_objects', 'top_containers')
+
+# Properties maintained by the backend, which differ between two saves of the same content
+SYSTEM_PROPERTIES = {'lock_version', 'system_mtime', 'user_mtime', 'create_time', 'created_by', 'last_modified_by'}
+
+
+def snapshots_dir():
+    return config.datadir / 'snapshots'
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _object_path(digest):
+    return snapshots_dir() / 'objects' / digest[:2] / f'{digest}.json.gz'
+
+
+def store(record):
+    """Store a record, unless a record with the same content is already stored, and return its content hash."""
+    data = json.dumps(record, sort_keys=True, separators=(',', ':')).encode()
+    digest = hashlib.sha256(data).hexdigest()
+    path = _object_path(digest)
+    if not path.exists():
+        _write_atomic(path, gzip.compress(data, mtime=0))
+    return digest
+
+
+def load(digest):
+    with gzip.open(_object_path(digest), 'rb') as f:
+        return json.load(f)
+
+
+def content(record):
+    """A record without its system properties, to compare what users can change."""
+    if isinstance(record, dict):
+        return {k: content(v) for k, v in record.items() if k not in SYSTEM_PROPERTIES}
+    if isinstance(record, list):
+        return [content(v) for v in record]
+    return record
+
+
+def _manifests(repo):
+    """The manifest files of the snapshots of a repository, oldest first."""
+    directory = snapshots_dir() / str(repo)
+    return sorted(directory.glob('*.json.gz')) if directory.is_dir() else []
+
+
+def _read_manifest(path):
+    with gzip.open(path, 'rb') as f:
+        return json.load(f)
+
+
+def _find(repo, snapshot_id):
+    """The manifest of the specified snapshot of a repository, or of its latest one."""
+    manifests = _manifests(repo)
+    if snapshot_id is not None:
+        manifests = [path for path in manifests if path.name == f'{snapshot_id}.json.gz']
+    if not manifests:
+        print(f"Snapshot {snapshot_id} of repository {repo} not found" if snapshot_id is not None
+              else f"There are no snapshots of repository {repo}", file=sys.stderr)
+        exit(1)
+    return _read_manifest(manifests[-1])
+
+
+def _since(watermark):
+    return int(datetime.fromisoformat(watermark.replace('Z', '+00:00')).timestamp())
+
+
+def create(repo, full, page_size, workers):
+    """Snapshot the resources, archival objects and top containers of a repository, and print the snapshot ID.
+
+    Only the records created or modified since the previous snapshot of the repository (from the same ArchivesSpace
+    instance) are fetched, unless a full snapshot is requested.
+    """
+    repo = config.get_default("repository", repo)
+    baseurl = config.asnake_config['baseurl']
+    previous = None
+    if not full:
+        manifests = _manifests(repo)
+        if manifests:
+            previous = _read_manifest(manifests[-1])
+            if previous['baseurl'] != baseurl:
+                previous = None
+
+    snapshot_id = time.strftime('%Y%m%d-%H%M%S')
+    manifest = {'id': snapshot_id, 'repo': repo, 'baseurl': baseurl, 'created': time.time(), 'types': {}}
+    fetched = 0
+    try:
+        for record_type in RECORD_TYPES:
+            endpoint = f'repositories/{repo}/{record_type}'
+            ids = config.request('get', endpoint, params={'all_ids': True}).json()
+            old = previous['types'][record_type] if previous is not None else {'watermark': None, 'records': {}}
+            if old['watermark'] is not None:
+                modified = config.request('get', endpoint, params={'all_ids': True,
+                                                                   'modified_since': _since(old['watermark'])}).json()
+                wanted = set(modified) | {i for i in ids if str(i) not in old['records']}
+                todo = [i for i in ids if i in wanted]
+            else:
+                todo = ids
+            records = {str(i): old['records'][str(i)] for i in ids if str(i) in old['records']}
+            watermark = old['watermark']
+            for record in aio.get_all(endpoint, ids=todo, page_size=page_size, workers=workers):
+                records[record['uri'].rsplit('/', 1)[1]] = store(record)
+                if record.get('system_mtime') and (watermark is None or record['system_mtime'] > watermark):
+                    watermark = record['system_mtime']
+            fetched += len(todo)
+            manifest['types'][record_type] = {'watermark': watermark, 'records': records}
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+
+    path = snapshots_dir() / str(repo) / f'{snapshot_id}.json.gz'
+    _write_atomic(path, gzip.compress(json.dumps(manifest).encode()))
+    total = sum(len(t['records']) for t in manifest['types'].values())
+    print(f"Snapshot {snapshot_id} of repository {repo}: {total} records, {fetched} fetched", file=sys.stderr)
+    print(snapshot_id)
+
+
+def list_snapshots(repo):
+    """Print a tab-separated line (ID, creation time, number of records of each type) for each snapshot."""
+    repo = config.get_default("repository", repo)
+    for path in _manifests(repo):
+        manifest = _read_manifest(path)
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created']))
+        counts = [f"{record_type}={len(manifest['types'][record_type]['records'])}" for record_type in RECORD_TYPES]
+        print('\t'.join([manifest['id'], created, *counts]))
+
+
+def restore(snapshot_id, repo, record_type, dry_run, workers):
+    """Restore the records of a repository that were changed since a snapshot to their content in the snapshot.
+
+    Only the records modified since the snapshot are fetched and compared with their stored copy, and only those whose
+    content differs are saved. Records created since the snapshot are left alone, and records deleted since are
+    reported but not re-created. A tab-separated result line (record URI, 'restored' or 'unchanged', status, error) is
+    printed for each record modified since the snapshot.
+    """
+    repo = config.get_default("repository", repo)
+    manifest = _find(repo, snapshot_id)
+    if manifest['baseurl'] != config.asnake_config['baseurl']:
+        print(f"Snapshot {manifest['id']} was taken from {manifest['baseurl']}", file=sys.stderr)
+        exit(1)
+    if not dry_run:
+        # A resumed run restores the same snapshot, even if a newer one has been taken since
+        jobs.begin(snapshot_id=manifest['id'])
+
+    candidates = []
+    try:
+        for name in record_type or RECORD_TYPES:
+            saved = manifest['types'][name]
+            endpoint = f'repositories/{repo}/{name}'
+            current = set(config.request('get', endpoint, params={'all_ids': True}).json())
+            params = {'all_ids': True}
+            if saved['watermark'] is not None:
+                params['modified_since'] = _since(saved['watermark'])
+            modified = set(config.request('get', endpoint, params=params).json())
+            for record_id, digest in saved['records'].items():
+                if int(record_id) not in current or int(record_id) in modified:
+                    candidates.append((f'/{endpoint}/{record_id}', digest, int(record_id) in current))
+    except appconfig.APIError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+
+    async def restore_one(api, item):
+        uri, digest, exists = item
+        if not exists:
+            raise ValueError("The record was deleted after the snapshot, and is not re-created")
+        saved = load(digest)
+
+        def revert(record):
+            if content(record) == content(saved):
+                return False
+            if not dry_run:
+                lock_version = record.get('lock_version')
+                record.clear()
+                record.update(saved, lock_version=lock_version)
+            return True
+
+        changed, _ = await api.update(uri, revert)
+        return changed
+
+    failed = False
+    items = jobs.pending(candidates, key=lambda item: item[0])
+    for (uri, _, _), changed, error in aio.run(restore_one, items, workers):
+        action = None if error is not None else ('would restore' if dry_run else 'restored') if changed else 'unchanged'
+        batch.report(uri, action, error=error)
+        failed = failed or error is not None
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,86 @@
+import json
+import math
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+def endpoint_template(endpoint):
+    """Replace the record identifiers in an endpoint with '{id}', so that calls can be grouped by endpoint."""
+    path = endpoint.split('?', 1)[0].strip('/')
+    return re.sub(r'(?<=/)\d+(?=/|$)', '{id}', '/' + path)
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def _size(n):
+    for unit in ('B', 'kB', 'MB'):
+        if n < 1000:
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1000
+    return f'{n:.1f} GB'
+
+
+class Tracer(object):
+    """Records every HTTP call to the API, and authentication and retry events, as JSON lines.
+
+    Lines are written to stderr if the destination is '-', '1' or 'stderr', and appended to the named file otherwise.
+    Calls are also aggregated per method and endpoint for the summary printed when the command finishes.
+    """
+
+    def __init__(self, destination):
+        if destination in ('-', '1', 'stderr'):
+            self.file = None
+        else:
+            self.file = open(destination, 'a', buffering=1)
+        self.lock = threading.Lock()
+        self.calls = defaultdict(list)
+        self.events = defaultdict(int)
+
+    def _emit(self, record):
+        line = json.dumps({'time': round(time.time(), 6), **record}, separators=(',', ':'))
+        with self.lock:
+            print(line, file=self.file or sys.stderr, flush=self.file is None)
+
+    def request(self, client, method, endpoint, status, seconds, sent, received, error=None):
+        template = endpoint_template(endpoint)
+        record = {'event': 'request', 'client': client, 'method': method.upper(), 'endpoint': template,
+                  'path': endpoint, 'status': status, 'ms': round(seconds * 1000, 3), 'sent': sent,
+                  'received': received}
+        if error is not None:
+            record['error'] = error
+        with self.lock:
+            self.calls[(method.upper(), template)].append((status, seconds, sent, received))
+        self._emit(record)
+
+    def event(self, event, **fields):
+        with self.lock:
+            self.events[event] += 1
+        self._emit({'event': event, **fields})
+
+    def summary(self):
+        """Print a table of calls per endpoint: count, errors, p50/p95 latency and bytes sent and received."""
+        if not self.calls and not self.events:
+            return
+        rows = [('METHOD', 'ENDPOINT', 'CALLS', 'ERRORS', 'P50 MS', 'P95 MS', 'SENT', 'RECEIVED')]
+        for (method, template), calls in sorted(self.calls.items(), key=lambda item: -len(item[1])):
+            latencies = sorted(seconds for _, seconds, _, _ in calls)
+            rows.append((method, template, str(len(calls)), str(sum(1 for c in calls if c[0] not in (200, 304))),
+                         f'{_percentile(latencies, 0.5) * 1000:.1f}', f'{_percentile(latencies, 0.95) * 1000:.1f}',
+                         _size(sum(c[2] for c in calls)), _size(sum(c[3] for c in calls))))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            cells = [cell.ljust(width) if i < 2 else cell.rjust(width)
+                     for i, (cell, width) in enumerate(zip(row, widths))]
+            print('  '.join(cells).rstrip(), file=sys.stderr)
+        if self.events:
+            print(', '.join(f'{event}: {n}' for event, n in sorted(self.events.items())), file=sys.stderr)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()